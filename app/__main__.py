@@ -1,83 +1,50 @@
 import argparse
+import json
+import multiprocessing
 
-from mtbl_iokit.write import export_dataframe
-from app.src.mtbl_globals import ETLType, LG_RULESET, NO_MANAGERS, DIR_TRANSFORM
-from app.src.keymap import KeyMap
-from app.src.loader import Loader
-from app.src.cleaner import Cleaner
-from app.src.transformer import Transformer
-from app.src.appraiser import Appraiser
+import pandas as pd
 
+from app.src.mtbl_globals import ETLType
+from app.src.league import read_leagues
+from app.src.memory import compare_report
+from app.src.pipeline import run_pipeline, measure_pipeline
 
-def main(etl_type: ETLType):
+
+def main(etl_type: ETLType, parallel_load: bool = False, source_cache: str = None,
+         copy_on_write: bool = False, memory_report: bool = False, low_memory: bool = False,
+         leagues: list = None, parallel_leagues: bool = False, budget_profiles: dict = None):
     """
     Main controller.
     Note: if ETLType is PRE_SZN, keymap primary key should be set to other than ESPNID.
     :param etl_type: Enum for PRE_SZN or REG_SZN
+    :param parallel_load: parse the extracted files concurrently
+    :param source_cache: directory to cache parsed extract files in, None to always parse
+    :param copy_on_write: run the pipeline with pandas copy-on-write; slices and derived frames
+        share memory with their parent until written to
+    :param memory_report: run the pipeline without and with copy-on-write, each in a fresh
+        process, and print both runs' peak RSS per stage and the difference; copy_on_write is
+        then ignored.  With a source_cache, the first run fills it and the second reads it
+    :param low_memory: load and clean into categorical and downcast dtypes, and print each
+        frame's size before and after
+    :param leagues: list of League to value the players for, all from one load and clean pass;
+        None values the LG_RULESET league into DIR_TRANSFORM
+    :param parallel_leagues: transform and appraise the leagues concurrently
+    :param budget_profiles: profile name -> budget split; every league also exports a
+        player x profile price table, mtbl_profiles
     """
-    km = KeyMap(primary_key="FANGRAPHSID").keymap  # object has keymap attribute
-    loader = Loader(keymap=km, etl_type=etl_type)  # object has combined dfs
-    loader.load_extracted_data()
-    # clean data
-    cleaner = Cleaner(etl_type=etl_type, bats=loader.combined_bats, arms=loader.combined_arms)
-    clean_bats = cleaner.clean_hitters()
-    clean_sps, clean_rps = cleaner.clean_pitchers()
-    # standardize datasets
-    transformer = Transformer(ruleset=LG_RULESET,
-                              no_managers=NO_MANAGERS,
-                              bats=clean_bats,
-                              sps=clean_sps,
-                              rps=clean_rps)
-
-    bats = transformer.z_bats()
-    arms = transformer.z_arms()
-    # bats and arms are now keyed by pos
-    all_players = bats.copy().update(arms)
-
-    budget_pref = {
-        "bats": {
-            "ovr": 0.65,
-            "cats": {
-                "HR": 0.20,
-                "R": 0.15,
-                "RBI": 0.10,
-                "SBN": 0.15,
-                "OBP": 0.20,
-                "SLG": 0.20
-            }
-        },
-        "sps": {
-            "ovr": 0.20,
-            "cats": {
-                "IP": 0.15,
-                "QS": 0.20,
-                "ERA": 0.20,
-                "WHIP": 0.20,
-                "K/9": 0.25
-            }
-        },
-        "rps": {
-            "ovr": 0.15,
-            "cats": {
-                "IP": 0.15,
-                "SVHD": 0.20,
-                "ERA": 0.20,
-                "WHIP": 0.20,
-                "K/9": 0.25
-            }
-        }
-    }
-    app = Appraiser(ruleset=LG_RULESET,
-                    no_managers=NO_MANAGERS,
-                    budget_split=budget_pref,
-                    bats=bats, arms=arms)
-    app.calculate_league_batting_category_totals()
-    app.calculate_batting_category_weights_shekels()
-    app.calculate_pitching_category_weights_shekels()
-    app.add_skekels()
+    pipeline_args = (etl_type, parallel_load, source_cache, low_memory, leagues,
+                     parallel_leagues, budget_profiles)
+    if not memory_report:
+        with pd.option_context("mode.copy_on_write", copy_on_write):
+            run_pipeline(*pipeline_args)
+        return
 
-    for pos, pos_group in app.pos_groups.items():
-        export_dataframe(pos_group["players"], "mtbl_" + pos.lower(), ".json", DIR_TRANSFORM)
+    # a fresh process per mode, so neither run inherits the other's heap
+    memories = []
+    for mode in [False, True]:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            memories.append(pool.apply(measure_pipeline, (mode, *pipeline_args)))
+    print(compare_report(*memories, labels=("default", "cow")))
 
 
 if __name__ == '__main__':
@@ -88,6 +55,48 @@ if __name__ == '__main__':
         choices=list(ETLType),
         help="ETL Type; PRE_SZN or REG_SZN",
         default=ETLType.REG_SZN)
+    parser.add_argument(
+        "--parallel-load",
+        action="store_true",
+        help="Parse the extracted files concurrently")
+    parser.add_argument(
+        "--source-cache",
+        help="Directory to cache parsed extract files in; unchanged files are not re-parsed",
+        default=None)
+    parser.add_argument(
+        "--copy-on-write",
+        action="store_true",
+        help="Run the pipeline with pandas copy-on-write to avoid defensive frame copies")
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="Run the pipeline without and with copy-on-write and print both runs' peak RSS "
+             "per stage and the difference")
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="Use categorical and downcast dtypes for the player frames")
+    parser.add_argument(
+        "--leagues",
+        help="Json file with a list of league configs (name, ruleset, no_managers, budget_split, "
+             "out_dir) to value from one load and clean pass",
+        default=None)
+    parser.add_argument(
+        "--parallel-leagues",
+        action="store_true",
+        help="Transform and appraise the leagues concurrently")
+    parser.add_argument(
+        "--budget-profiles",
+        help="Json file mapping profile names to budget splits; also exports a player x "
+             "profile price table",
+        default=None)
 
     args = parser.parse_args()
-    main(args.etl_type)
+    budget_profiles = None
+    if args.budget_profiles:
+        with open(args.budget_profiles) as f:
+            budget_profiles = json.load(f)
+    main(args.etl_type, args.parallel_load, args.source_cache, args.copy_on_write,
+         args.memory_report, args.low_memory,
+         read_leagues(args.leagues) if args.leagues else None, args.parallel_leagues,
+         budget_profiles)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from app.src.transformer import bucket_wildcard_arms
@@ -51,8 +52,10 @@ class Appraiser:
                 self.lg_category_totals["BATTING"][pos] = {}
                 for cat in self.ruleset["SCORING"]["BATTING"]:
                     proj_cat = f"proj_{cat}"
-                    # #loc slicing is inclusive, need to subtract 1
-                    pos_group_cat_tot = pos_group["players"].loc[:num_players - 1, proj_cat].sum()
+                    # #loc slicing is inclusive, need to subtract 1; totals are summed in
+                    # float64 whatever the projection's (possibly downcast) dtype
+                    pos_group_cat_tot = pos_group["players"].loc[
+                                        :num_players - 1, proj_cat].astype("float64").sum()
                     self.lg_category_totals["BATTING"]["TOTALS"][cat] += pos_group_cat_tot
                     self.lg_category_totals["BATTING"][pos][cat] = pos_group_cat_tot
 
@@ -156,6 +159,64 @@ class Appraiser:
             pos_group["players"]["shekels"] = pos_group["players"].filter(
                 like="_shekels").sum(axis=1)
 
+    def price_profiles(self, profiles: dict) -> pd.DataFrame:
+        """
+        Shekels for several budget splits at once.  The budget independent part of the pricing
+        (the position groups' category weights and pool z sums, see
+        #calculate_batting_category_weights_shekels) is built once per position group as a
+        shekel-per-z rate for each category; one matrix product of the group's z block with the
+        rates scaled by every profile's category split then prices all players for all profiles.
+        Leaves pos_groups and lg_category_totals untouched.
+        :param profiles: profile name -> budget split, shaped like budget_split
+        :return: Dataframe with ESPNID, pos and a shekels column per profile; one row per player
+            in each position group, in pos_groups order
+        """
+        for name, budget_split in profiles.items():
+            if not budget_is_valid(budget_split):
+                raise ValueError(f"Budget split {name} is invalid.")
+
+        pos_blocks = {}
+        for pos, pos_group in self.pos_groups.items():
+            pos_type = "PITCHING" if pos in ["SP", "RP"] else "BATTING"
+            cats = [cat for cat in self.ruleset["SCORING"][pos_type]
+                    if f"proj_{cat}" in pos_group["players"].columns]
+            players = pos_group["players"]
+            pool = slice(0, pos_group["pool_size"])
+            z_block = players[[f"z_proj_{cat}" for cat in cats]].to_numpy(dtype=np.float64)
+            pos_blocks[pos] = {
+                "cats": cats,
+                "z": z_block,
+                "pool_z": np.nansum(z_block[pool], axis=0),
+                "pool_proj": np.nansum(players[[f"proj_{cat}" for cat in cats]].to_numpy(
+                    dtype=np.float64)[pool], axis=0) if pos_type == "BATTING" else None}
+
+        # league batting totals per category, for the positional weights; the batting groups
+        # share their columns, so their categories line up
+        lg_batting_totals = sum(block["pool_proj"] for pos, block in pos_blocks.items()
+                                if pos not in ["SP", "RP"])
+
+        prices = []
+        for pos, block in pos_blocks.items():
+            budget_group = {"SP": "sps", "RP": "rps"}.get(pos, "bats")
+            if pos in ["SP", "RP"]:
+                pos_weights = np.ones(len(block["cats"]))
+            else:
+                pos_weights = block["pool_proj"] / lg_batting_totals
+            rates = self.lg_budget * pos_weights / block["pool_z"]
+            # profiles x categories share of the league budget
+            splits = np.array([[split[budget_group]["ovr"] *
+                                split[budget_group]["cats"].get(cat, 0) for cat in block["cats"]]
+                               for split in profiles.values()]).reshape(len(profiles), -1)
+            shekels = np.nan_to_num(block["z"]) @ (rates[:, None] * splits.T)
+
+            players = self.pos_groups[pos]["players"]
+            price_table = pd.DataFrame(shekels, columns=list(profiles))
+            price_table.insert(0, "ESPNID", players["ESPNID"].to_numpy())
+            price_table.insert(1, "pos", pos)
+            prices.append(price_table)
+
+        return pd.concat(prices, ignore_index=True)
+
 
 def budget_is_valid(budget_split: dict) -> bool:
     """
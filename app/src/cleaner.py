@@ -1,20 +1,145 @@
 from unittest import case
 
+import numpy as np
 import pandas as pd
 
+from app.src.memory import frame_bytes
 from app.src.mtbl_globals import ETLType
 
+# Column registry: the columns that survive cleaning for each position group.  Loader reads only
+# these (plus its join keys) when projecting columns, so both classes share one source of truth.
+BATS_COLUMNS = ['ESPNID', 'FANGRAPHSID', 'MLBID', 'player_key', 'name', 'team', 'positions',
+                'proj_G', 'proj_PA', 'proj_AB', 'proj_H', 'proj_HR', 'proj_R', 'proj_RBI',
+                'proj_SBN', 'proj_AVG', 'proj_OBP', 'proj_SLG', 'proj_OPS', 'proj_BB%',
+                'proj_K%', 'proj_wOBA', 'proj_ISO', 'proj_BABIP', 'proj_wRC', 'proj_wRAA',
+                'proj_wRC+', 'proj_WAR',
+                'pa', 'xslg', 'woba', 'xwoba', 'xobp', "sweet_spot_percent",
+                "barrel_batted_rate", "hard_hit_percent", "avg_best_speed", "avg_hyper_speed",
+                "oz_swing_percent", "n_bolts", "xwOBA_diff", "xSLG_diff", "xOBP_diff"
+                ]
+BATS_PRE_SZN_COLUMNS = ['year']
+BATS_REG_SZN_COLUMNS = ['owner',
+                        'prtr_%ROST', 'prtr_PRTR', 'prtr_HR', 'prtr_R',
+                        'prtr_RBI', 'prtr_SBN', 'prtr_OBP', 'prtr_SLG',
+                        'G', 'PA', 'HR', 'R', 'RBI', 'SBN', 'AVG', 'OBP', 'SLG',
+                        'on_base_plus_slg', 'BB%', 'K%', 'wOBA', 'ISO', 'BABIP',
+                        'wRC+', 'WAR'
+                        ]
+ARMS_COLUMNS = ['ESPNID', 'FANGRAPHSID', 'MLBID', 'player_key', 'name', 'team', 'positions',
+                'proj_G', 'proj_GS', 'proj_IP', 'proj_QS', 'proj_SVHD',
+                'proj_ERA', 'proj_WHIP', 'proj_K/9', 'proj_FIP', 'proj_BB/9', 'proj_K/BB',
+                'proj_HR/9', 'proj_BABIP', 'proj_WAR',
+                'woba', 'xwoba', "xwOBA_diff", 'hard_hit_percent', 'avg_best_speed',
+                'avg_hyper_speed', 'whiff_percent', 'swing_percent']
+ARMS_PRE_SZN_COLUMNS = ["year"]
+ARMS_REG_SZN_COLUMNS = ['owner',
+                        'prtr_%ROST', "prtr_PRTR", "prtr_IP", "prtr_QS", "prtr_ERA",
+                        "prtr_WHIP", "prtr_K/9", "prtr_SVHD",
+                        'G', 'GS', 'IP', 'ERA', 'WHIP', 'K/9', 'p_save', 'p_hold', 'SVHD',
+                        'p_quality_start', 'FIP', 'BB/9', 'HR/9', 'BABIP', 'WAR',
+                        'k_percent', 'bb_percent']
+# columns the cleaner derives new columns from, e.g. proj_SBN = proj_SB - proj_CS
+BATS_DERIVED_FROM = ['proj_SB', 'proj_CS', 'r_total_stolen_base', 'r_total_caught_stealing']
+ARMS_DERIVED_FROM = ['proj_SV', 'proj_HLD']
+# positional eligibility bitmask: one bit per position.  The bit of the first listed position is
+# repeated FIRST_POS_SHIFT bits higher, so "listed first as DH" is a mask test too.
+POSITION_BITS = {"C": 1, "1B": 2, "2B": 4, "3B": 8, "SS": 16, "OF": 32, "DH": 64, "SP": 128,
+                 "RP": 256}
+FIRST_POS_SHIFT = 16
+# low-memory mode schema (see lean_dtypes): low cardinality strings become categoricals and the
+# stats are downcast to the first candidate dtype their values fit.  Keys, player_key, pos_mask
+# and the lists in positions keep their dtypes.
+CATEGORY_COLUMNS = ["team", "owner", "pri_pos", "year"]
+LEAN_DOWNCASTS = {"Int64": ["Int16", "Int32"], "int64": ["int16", "int32"],
+                  "Float64": ["Float32"], "float64": ["float32"]}
+
+
+def clean_columns(etl_type: ETLType, pos: str) -> list:
+    """
+    Columns that survive cleaning
+    :param etl_type: PRE_SZN or REG_SZN
+    :param pos: bats or arms
+    :return: list of column names
+    """
+    match etl_type:
+        case ETLType.PRE_SZN:
+            etl_columns = BATS_PRE_SZN_COLUMNS if pos == "bats" else ARMS_PRE_SZN_COLUMNS
+        case ETLType.REG_SZN:
+            etl_columns = BATS_REG_SZN_COLUMNS if pos == "bats" else ARMS_REG_SZN_COLUMNS
+
+    return (BATS_COLUMNS if pos == "bats" else ARMS_COLUMNS) + etl_columns
+
+
+def required_columns(etl_type: ETLType, pos: str) -> list:
+    """
+    Columns cleaning needs from the combined df: the cleaned columns and what they are derived
+    from
+    :param etl_type: PRE_SZN or REG_SZN
+    :param pos: bats or arms
+    :return: list of column names
+    """
+    return clean_columns(etl_type, pos) + (BATS_DERIVED_FROM if pos == "bats" else
+                                           ARMS_DERIVED_FROM)
+
+
+def lean_dtypes(df: pd.DataFrame) -> dict:
+    """
+    Low-memory schema for a frame: CATEGORY_COLUMNS as categoricals, the stats downcast per
+    LEAN_DOWNCASTS.  Integer columns only take a narrower dtype their values fit in.
+    :param df: loaded or cleaned players
+    :return: column -> dtype for the columns that change, for df.astype
+    """
+    schema = {}
+    for col, dtype in df.dtypes.items():
+        if col in CATEGORY_COLUMNS:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                schema[col] = "category"
+        elif col != "player_key" and str(dtype) in LEAN_DOWNCASTS:
+            fitting = [lean for lean in LEAN_DOWNCASTS[str(dtype)] if fits(df[col], lean)]
+            if fitting:
+                schema[col] = fitting[0]
+
+    return schema
+
+
+def fits(series: pd.Series, dtype: str) -> bool:
+    """
+    :param series: numeric column
+    :param dtype: dtype to downcast to
+    :return: False if dtype is an integer dtype too narrow for the values
+    """
+    if not pd.api.types.is_integer_dtype(dtype) or series.isna().all():
+        return True
+    # nullable Int16 has the limits of int16
+    limits = np.iinfo(dtype.lower())
+
+    return limits.min <= series.min() and series.max() <= limits.max
+
+
+def to_lean_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param df: players
+    :return: df cast to its lean_dtypes
+    """
+    return df.astype(lean_dtypes(df))
+
 
 class Cleaner:
-    def __init__(self, etl_type: ETLType, bats: pd.DataFrame, arms: pd.DataFrame) -> None:
+    def __init__(self, etl_type: ETLType, bats: pd.DataFrame, arms: pd.DataFrame,
+                 low_memory: bool = False) -> None:
         """
         :param etl_type: ETLType to clean
         :param bats: combined df for bats
         :param arms: combined df for arms
+        :param low_memory: cast the cleaned frames to categorical and downcast dtypes, see
+            lean_dtypes; frame_bytes records each frame's size before and after
         """
         self.etl_type = etl_type
         self.bats = bats
         self.arms = arms
+        self.low_memory = low_memory
+        # frame name -> (bytes before, bytes after) the low-memory cast
+        self.frame_bytes = {}
 
     def clean_hitters(self) -> pd.DataFrame:
         """
@@ -24,35 +149,14 @@ class Cleaner:
         self.bats["proj_SBN"] = self.bats["proj_SB"] - self.bats["proj_CS"]
         self.bats["SBN"] = self.bats["r_total_stolen_base"] - self.bats["r_total_caught_stealing"]
 
-        columns = ['ESPNID', 'FANGRAPHSID', 'MLBID', 'name', 'team', 'positions',
-                   'proj_G', 'proj_PA', 'proj_AB', 'proj_H', 'proj_HR', 'proj_R', 'proj_RBI',
-                   'proj_SBN', 'proj_AVG', 'proj_OBP', 'proj_SLG', 'proj_OPS', 'proj_BB%',
-                   'proj_K%', 'proj_wOBA', 'proj_ISO', 'proj_BABIP', 'proj_wRC', 'proj_wRAA',
-                   'proj_wRC+', 'proj_WAR',
-                   'pa', 'xslg', 'woba', 'xwoba', 'xobp', "sweet_spot_percent",
-                   "barrel_batted_rate", "hard_hit_percent", "avg_best_speed", "avg_hyper_speed",
-                   "oz_swing_percent", "n_bolts", "xwOBA_diff", "xSLG_diff", "xOBP_diff"
-                   ]
-
-        sort_value = ""
-
-        match self.etl_type:
-            case ETLType.PRE_SZN:
-                columns += ['year']
-                sort_value = "proj_wRC+"
-            case ETLType.REG_SZN:
-                columns += ['owner',
-                            'prtr_%ROST', 'prtr_PRTR', 'prtr_HR', 'prtr_R',
-                            'prtr_RBI', 'prtr_SBN', 'prtr_OBP', 'prtr_SLG',
-                            'G', 'PA', 'HR', 'R', 'RBI', 'SBN', 'AVG', 'OBP', 'SLG',
-                            'on_base_plus_slg', 'BB%', 'K%', 'wOBA', 'ISO', 'BABIP',
-                            'wRC+', 'WAR'
-                            ]
-                sort_value = "proj_wRC+"
+        columns = clean_columns(self.etl_type, "bats")
+        sort_value = "proj_wRC+"
 
         clean_bats = self.bats[columns].sort_values(by=sort_value, ascending=False)
+        clean_bats.insert(columns.index("positions") + 1, "pos_mask",
+                          encode_positions(clean_bats["positions"]))
         # players with no projections are not useful for analysis
-        return clean_bats.dropna(subset="proj_wRC+")
+        return self.lean("clean bats", clean_bats.dropna(subset="proj_wRC+"))
 
     def clean_pitchers(self) -> (pd.DataFrame, pd.DataFrame):
         """
@@ -60,32 +164,77 @@ class Cleaner:
         :return: tuple of dataframes containing SPs and RPs
         """
         self.arms["proj_SVHD"] = self.arms["proj_SV"] + self.arms["proj_HLD"]
-        clean_sps = self.arms[self.arms["proj_QS"] > self.arms["proj_SVHD"]]
-        clean_rps = self.arms[self.arms["proj_SVHD"] >= self.arms["proj_QS"]]
-        columns = ['ESPNID', 'FANGRAPHSID', 'MLBID', 'name', 'team', 'positions',
-                   'proj_G', 'proj_GS', 'proj_IP', 'proj_QS', 'proj_SVHD',
-                   'proj_ERA', 'proj_WHIP', 'proj_K/9', 'proj_FIP', 'proj_BB/9', 'proj_K/BB',
-                   'proj_HR/9', 'proj_BABIP', 'proj_WAR',
-                   'woba', 'xwoba', "xwOBA_diff", 'hard_hit_percent', 'avg_best_speed',
-                   'avg_hyper_speed', 'whiff_percent', 'swing_percent']
-        sort_value = ""
-
-        match self.etl_type:
-            case ETLType.PRE_SZN:
-                columns += ["year"]
-                sort_value = "proj_FIP"
-            case ETLType.REG_SZN:
-                columns += ['owner',
-                            'prtr_%ROST', "prtr_PRTR", "prtr_IP", "prtr_QS", "prtr_ERA",
-                            "prtr_WHIP", "prtr_K/9", "prtr_SVHD",
-                            'G', 'GS', 'IP', 'ERA', 'WHIP', 'K/9', 'p_save', 'p_hold', 'SVHD',
-                            'p_quality_start', 'FIP', 'BB/9', 'HR/9', 'BABIP', 'WAR',
-                            'k_percent', 'bb_percent']
-                sort_value = "proj_FIP"
-
-        clean_sps = clean_sps[columns].drop(columns="proj_SVHD").sort_values(sort_value,
-                                                                             ascending=True)
-        clean_rps = clean_rps[columns].drop(columns="proj_QS").sort_values(sort_value,
-                                                                           ascending=True)
-
-        return clean_sps.dropna(subset="proj_IP"), clean_rps.dropna(subset="proj_IP")
+        columns = clean_columns(self.etl_type, "arms")
+        sort_value = "proj_FIP"
+        is_sp = self.arms["proj_QS"] > self.arms["proj_SVHD"]
+        is_rp = self.arms["proj_SVHD"] >= self.arms["proj_QS"]
+        # rows and cleaned columns are taken in one slice; the full width frame is never copied
+        sp_columns = [col for col in columns if col != "proj_SVHD"]
+        rp_columns = [col for col in columns if col != "proj_QS"]
+
+        clean_sps = self.arms.loc[is_sp, sp_columns].sort_values(sort_value, ascending=True)
+        clean_rps = self.arms.loc[is_rp, rp_columns].sort_values(sort_value, ascending=True)
+
+        return (self.lean("clean sps", clean_sps.dropna(subset="proj_IP")),
+                self.lean("clean rps", clean_rps.dropna(subset="proj_IP")))
+
+    def lean(self, name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        In low-memory mode, cast df to its lean dtypes and record its size before and after
+        :param name: frame name for frame_bytes
+        :param df: cleaned frame
+        :return: df, cast if low_memory
+        """
+        if not self.low_memory:
+            return df
+        lean_df = to_lean_dtypes(df)
+        self.frame_bytes[name] = (frame_bytes(df), frame_bytes(lean_df))
+
+        return lean_df
+
+
+def encode_positions(positions: pd.Series) -> np.ndarray:
+    """
+    Encodes the positions lists into eligibility bitmasks (see POSITION_BITS) in one vectorized
+    pass over the exploded lists; positions not in POSITION_BITS get no bit.
+    :param positions: series of position lists, e.g. ["1B", "DH"]
+    :return: int32 array of bitmasks aligned to positions
+    """
+    # one row per (player, position); empty lists and NaN explode to a single NaN row
+    exploded = pd.Series(positions.to_numpy(), dtype=object).explode()
+    owner = exploded.index.to_numpy()
+    bits = exploded.map(POSITION_BITS).fillna(0).to_numpy(dtype=np.int32)
+
+    pos_mask = np.zeros(len(positions), dtype=np.int32)
+    np.bitwise_or.at(pos_mask, owner, bits)
+    first = ~exploded.index.duplicated()
+    pos_mask[owner[first]] |= bits[first] << FIRST_POS_SHIFT
+
+    return pos_mask
+
+
+def eligible(pos_mask, pos: str) -> np.ndarray:
+    """
+    :param pos_mask: bitmasks from encode_positions
+    :param pos: position, e.g. SS
+    :return: bool array, True where the player is eligible at pos
+    """
+    return (np.asarray(pos_mask) & POSITION_BITS[pos]) != 0
+
+
+def listed_first(pos_mask, pos: str) -> np.ndarray:
+    """
+    :param pos_mask: bitmasks from encode_positions
+    :param pos: position, e.g. DH
+    :return: bool array, True where pos is the player's first listed position
+    """
+    return (np.asarray(pos_mask) >> FIRST_POS_SHIFT) == POSITION_BITS[pos]
+
+
+def multi_eligible(pos_mask) -> np.ndarray:
+    """
+    :param pos_mask: bitmasks from encode_positions
+    :return: bool array, True where the player is eligible at more than one position
+    """
+    eligibility = np.asarray(pos_mask) & ((1 << FIRST_POS_SHIFT) - 1)
+    return (eligibility & (eligibility - 1)) != 0
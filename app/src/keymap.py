@@ -4,84 +4,383 @@ by: pubins.taylor
 date: 29 FEB 2024
 keymap.py
 """
+import hashlib
 import io
 import json
 import os
+import urllib.error
+import urllib.request
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from app.src.mtbl_globals import DIR_EXTRACT, DIR_TRANSFORM, MTBL_KEYMAP_URL
 from mtbl_iokit.write import write
 
+KEYMAP_FILE = "mtbl_keymap.json"
+KEYMAP_CACHE_FILE = "mtbl_keymap.parquet"
+# ETag/Last-Modified of the published sheet from the last incremental refresh
+KEYMAP_VALIDATORS_FILE = "mtbl_keymap_validators.json"
+# parquet schema metadata keys used to check cache freshness against the source .json
+CACHE_MTIME_KEY = b"mtbl_source_mtime_ns"
+CACHE_HASH_KEY = b"mtbl_source_sha256"
+# id spaces the crosswalk can translate between
+CROSSWALK_KEYS = ["ESPNID", "MLBID", "FANGRAPHSID", "BREFID"]
+
 
 class KeyMap:
-    def __init__(self, keymap_dir=DIR_EXTRACT, primary_key: str = "ESPNID"):
+    def __init__(self, keymap_dir=DIR_EXTRACT, primary_key: str = "ESPNID",
+                 use_cache: bool = True):
         self.keymap = None
-        self.load_keymap(keymap_dir, primary_key)
+        self.crosswalk = None
+        self.load_keymap(keymap_dir, primary_key, use_cache)
 
         if keymap_dir == DIR_TRANSFORM:
             verify_transform_dir()
 
-    def load_keymap(self, keymap_dir: str, primary_key: str) -> None:
+    def load_keymap(self, keymap_dir: str, primary_key: str, use_cache: bool = True) -> None:
         """
-        Load keymap from directory
+        Load keymap from directory.  When a fresh parquet cache sits next to the keymap .json,
+        the keymap is read from the cache and no JSON parsing takes place.
         :param keymap_dir: containing keymap file
         :param primary_key: sets the primary key of the keymap.
             Options: ESPNID, MLBID, FANGRAPHSID, BREFID
+        :param use_cache: read from (and write to) the parquet cache
         :return: None
         """
-        # make DIR_EXTRACT if it doesn't exist
-        with open(os.path.join(keymap_dir, "mtbl_keymap.json")) as f:
-            # keymap is loaded with schema, need to access data key
-            json_data = json.load(f)["data"]
-            # Setting drop=False prevents the removal of the primary key column,
-            # retaining it along with its name within the DataFrame.
-            keymap = pd.read_json(io.StringIO(json.dumps(json_data)))
-            keymap = convert_num_id_cols(keymap)
+        keymap = read_keymap_cache(keymap_dir) if use_cache else None
+
+        if keymap is None:
+            keymap = read_keymap_json(keymap_dir)
+            if use_cache:
+                write_keymap_cache(keymap, keymap_dir)
+
+        # Setting drop=False prevents the removal of the primary key column,
+        # retaining it along with its name within the DataFrame.
+        keymap.set_index(primary_key, drop=False, inplace=True)
+        keymap.index.name = "idx" + primary_key
 
-            keymap.set_index(primary_key, drop=False, inplace=True)
-            keymap.index.name = "idx" + primary_key
+        self.keymap = keymap
+        self.crosswalk = Crosswalk(keymap)
 
-            self.keymap = keymap
+    def translate(self, ids, src: str, dst: str):
+        """
+        Translate ids from one id space to another, e.g. MLBID -> ESPNID
+        :param ids: single id or list-like of ids
+        :param src: id space of the given ids
+        :param dst: id space to translate to
+        :return: see #Crosswalk.translate
+        """
+        return self.crosswalk.translate(ids, src, dst)
 
     @staticmethod
-    def refresh_keymap(save_dir: str = DIR_EXTRACT):
+    def refresh_keymap(save_dir: str = DIR_EXTRACT, incremental: bool = False,
+                       url: str = MTBL_KEYMAP_URL) -> dict | None:
         """
-        Static method to refresh keymap, compares timestamps to determine if fetching is necessary
+        Static method to refresh keymap, compares timestamps to determine if fetching is necessary.
+        The parquet cache is rewritten alongside the .json so the next load is warm.
         :param save_dir: directory to save file
-        :return:
+        :param incremental: send a conditional request and only apply the rows that changed;
+            see #refresh_keymap_incremental
+        :param url: published keymap sheet
+        :return: None for a full refresh, the refresh summary if incremental
         """
+        if incremental:
+            return refresh_keymap_incremental(save_dir, url)
+
         # read html appends each table to list, access dataframe with index
-        new_keymap = pd.read_html(MTBL_KEYMAP_URL, header=1)[0]
-        # reset index, drop index column, remove bad rows
-        new_keymap = new_keymap.reset_index(drop=True).drop(columns="1").dropna(how='all')
+        new_keymap = clean_keymap_table(pd.read_html(url, header=1)[0])
 
-        new_keymap = convert_num_id_cols(new_keymap)
+        write.export_dataframe(new_keymap, "mtbl_keymap", ".json", save_dir)
+        # cache what #load_keymap would build from the written file, not the in-memory frame
+        write_keymap_cache(read_keymap_json(save_dir), save_dir)
+
+
+def refresh_keymap_incremental(save_dir: str = DIR_EXTRACT, url: str = MTBL_KEYMAP_URL) -> dict:
+    """
+    Conditional, row-level keymap refresh.
+    The sheet is requested with the ETag/Last-Modified validators saved by the last refresh; a
+    304 means nothing changed and nothing is parsed.  Otherwise the sheet is parsed and diffed
+    row by row against the local keymap; only added and removed rows are applied and the files
+    are rewritten only when there is a difference.
+    :param save_dir: directory holding the keymap
+    :param url: published keymap sheet
+    :return: dict with status (not_modified, unchanged, updated or created) and the number of
+        rows added and removed
+    """
+    has_local = os.path.exists(os.path.join(save_dir, KEYMAP_FILE))
+    validators = read_validators(save_dir) if has_local else {}
 
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            html = response.read().decode("utf-8")
+            validators = {"etag": response.headers.get("ETag"),
+                          "last_modified": response.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return {"status": "not_modified", "added": 0, "removed": 0}
+        raise
+
+    new_keymap = clean_keymap_table(pd.read_html(io.StringIO(html), header=1)[0])
+
+    if not has_local:
         write.export_dataframe(new_keymap, "mtbl_keymap", ".json", save_dir)
+        write_keymap_cache(read_keymap_json(save_dir), save_dir)
+        write_validators(validators, save_dir)
+        return {"status": "created", "added": len(new_keymap), "removed": 0}
+
+    local_keymap = read_keymap_cache(save_dir)
+    if local_keymap is None:
+        local_keymap = read_keymap_json(save_dir)
+
+    added, removed = diff_keymaps(local_keymap, new_keymap)
+    summary = {"status": "unchanged", "added": int(added.sum()), "removed": int(removed.sum())}
+
+    if added.any() or removed.any():
+        updated = pd.concat([local_keymap[~removed], new_keymap[added]], ignore_index=True)
+        write.export_dataframe(updated, "mtbl_keymap", ".json", save_dir)
+        write_keymap_cache(read_keymap_json(save_dir), save_dir)
+        summary["status"] = "updated"
+
+    write_validators(validators, save_dir)
+
+    return summary
+
+
+def clean_keymap_table(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tidy the table parsed from the published sheet
+    :param table: first table from the sheet's html, header=1
+    :return: keymap dataframe with converted id columns
+    """
+    # reset index, drop index column, remove bad rows
+    keymap = table.reset_index(drop=True).drop(columns="1").dropna(how='all')
+
+    return convert_num_id_cols(keymap)
 
 
-def convert_num_id_cols(df: pd.DataFrame) -> pd.DataFrame:
+def diff_keymaps(old: pd.DataFrame, new: pd.DataFrame) -> (pd.Series, pd.Series):
+    """
+    Row-level diff by hashing each row's values.  A changed row shows up as one removed and one
+    added row.
+    :param old: local keymap
+    :param new: freshly fetched keymap
+    :return: boolean masks; rows of new that are added, rows of old that are removed
+    """
+    def row_hashes(df: pd.DataFrame) -> pd.Series:
+        # compare as text so None/NaN and int/str renderings of the same value hash the same
+        values = df[new.columns].astype(object).where(df[new.columns].notna(), "").astype(str)
+        return pd.util.hash_pandas_object(values, index=False)
+
+    if set(old.columns) != set(new.columns):
+        return (pd.Series(True, index=new.index), pd.Series(True, index=old.index))
+
+    old_hashes = row_hashes(old)
+    new_hashes = row_hashes(new)
+    added = ~new_hashes.isin(old_hashes)
+    removed = ~old_hashes.isin(new_hashes)
+
+    return added, removed
+
+
+def read_validators(save_dir: str) -> dict:
+    """
+    :param save_dir: directory holding the keymap
+    :return: saved ETag/Last-Modified validators, empty if there are none
+    """
+    path = os.path.join(save_dir, KEYMAP_VALIDATORS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_validators(validators: dict, save_dir: str) -> None:
+    """
+    :param validators: ETag/Last-Modified of the last fetched sheet
+    :param save_dir: directory holding the keymap
+    :return: None
+    """
+    with open(os.path.join(save_dir, KEYMAP_VALIDATORS_FILE), "w") as f:
+        json.dump(validators, f)
+
+
+class Crosswalk:
+    def __init__(self, keymap: pd.DataFrame, keys: list = None):
+        """
+        Hash indexes over the keymap id columns so ids can be swapped between id spaces without
+        re-indexing or merging the whole keymap.  The id columns are held as arrays; for each
+        src -> dst pair a pd.Index of the src ids is built on first use, pointing at the keymap
+        row each id translates through.  When an id is duplicated in the keymap the first row
+        that has a dst id wins.
+        :param keymap: keymap dataframe
+        :param keys: id columns to index, defaults to CROSSWALK_KEYS
+        """
+        self.keys = keys if keys is not None else CROSSWALK_KEYS
+        self.ids = {key: keymap[key].to_numpy(dtype=object, na_value=None) for key in self.keys}
+        # (src, dst) -> (pd.Index of src ids, keymap row of each id)
+        self.indexes = {}
+
+    def index(self, src: str, dst: str) -> (pd.Index, np.ndarray):
+        """
+        :param src: id space to look up
+        :param dst: id space to translate to
+        :return: unique src ids with a dst id, and the keymap row for each
+        """
+        if src not in self.ids or dst not in self.ids:
+            raise KeyError(f"Crosswalk translates between {self.keys}; got {src} -> {dst}")
+
+        if (src, dst) not in self.indexes:
+            rows = np.flatnonzero(pd.notna(self.ids[src]) & pd.notna(self.ids[dst]))
+            src_ids = self.ids[src][rows]
+            first = ~pd.Series(src_ids).duplicated().to_numpy()
+            self.indexes[(src, dst)] = (pd.Index(src_ids[first]), rows[first])
+
+        return self.indexes[(src, dst)]
+
+    def translate(self, ids, src: str, dst: str):
+        """
+        Translate ids from src id space into dst id space
+        :param ids: single id or list-like of ids; numeric ids are normalized to strings
+        :param src: id space of the given ids
+        :param dst: id space to translate to
+        :return: the dst id (or None) for a single id; np.ndarray for list-likes; pd.Series
+            aligned to the input index for a pd.Series.  Missing translations are None.
+        """
+        index, rows = self.index(src, dst)
+
+        if pd.api.types.is_scalar(ids):
+            return self.translate([ids], src, dst)[0]
+
+        lookup = normalize_id_col(pd.Series(ids, dtype=None if len(ids) else object))
+        hits = index.get_indexer(lookup.to_numpy(dtype=object))
+        translated = np.full(len(hits), None, dtype=object)
+        found = hits >= 0
+        translated[found] = self.ids[dst][rows[hits[found]]]
+
+        if isinstance(ids, pd.Series):
+            return pd.Series(translated, index=ids.index, name=dst)
+
+        return translated
+
+
+def read_keymap_json(keymap_dir: str) -> pd.DataFrame:
+    """
+    Parse the keymap .json and convert the numerical id columns
+    :param keymap_dir: containing keymap file
+    :return: keymap dataframe, not yet indexed
+    """
+    with open(os.path.join(keymap_dir, KEYMAP_FILE)) as f:
+        # keymap is loaded with schema, need to access data key
+        json_data = json.load(f)["data"]
+        keymap = pd.read_json(io.StringIO(json.dumps(json_data)))
+
+    return convert_num_id_cols(keymap)
+
+
+def read_keymap_cache(keymap_dir: str) -> pd.DataFrame | None:
+    """
+    Read the parquet cache if it is still fresh.  The cache is fresh when the source .json
+    modification time matches the one recorded in the cache, or, failing that, when the content
+    hash matches (e.g. the file was touched or copied but not changed).
+    :param keymap_dir: containing keymap file and cache
+    :return: keymap dataframe, or None if the cache is missing or stale
+    """
+    cache_path = os.path.join(keymap_dir, KEYMAP_CACHE_FILE)
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowException):
+        return None
+
+    source_path = os.path.join(keymap_dir, KEYMAP_FILE)
+    mtime_ns = str(os.stat(source_path).st_mtime_ns).encode()
+    if metadata.get(CACHE_MTIME_KEY) != mtime_ns:
+        if metadata.get(CACHE_HASH_KEY) != file_sha256(source_path).encode():
+            return None
+
+    keymap = pd.read_parquet(cache_path)
+    # parquet hands back missing strings as None; keep the NaN the .json load produces
+    keymap["ESPNID"] = keymap["ESPNID"].fillna(np.nan)
+
+    return keymap
+
+
+def write_keymap_cache(keymap: pd.DataFrame, keymap_dir: str) -> None:
+    """
+    Write the converted keymap to parquet, stamped with the source .json mtime and content hash
+    :param keymap: converted keymap dataframe
+    :param keymap_dir: containing keymap file, cache is written next to it
+    :return: None
+    """
+    source_path = os.path.join(keymap_dir, KEYMAP_FILE)
+    table = pa.Table.from_pandas(keymap, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        CACHE_MTIME_KEY: str(os.stat(source_path).st_mtime_ns).encode(),
+        CACHE_HASH_KEY: file_sha256(source_path).encode()
+    })
+    pq.write_table(table, os.path.join(keymap_dir, KEYMAP_CACHE_FILE))
+
+
+def file_sha256(path: str) -> str:
+    """
+    :param path: file to hash
+    :return: hex digest of the file contents
+    """
+    # hashed in blocks, never holding the whole file in memory
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def convert_num_id_cols(df: pd.DataFrame, as_int: bool = False) -> pd.DataFrame:
     """
     Converts the columns that load in as floats or integers into strings
     :param df: the dataframe to convert
+    :param as_int: convert to nullable integers (Int64) instead of strings
     :return: a dataframe with only the columns known to load as numerical values
     """
-    def float_to_str(x):
-        if pd.notna(x).any():  # Check for at least one non-null value
+    for col in ["MLBID", "ESPNID"]:
+        df[col] = normalize_id_col(df[col], as_int)
+
+    return df
+
+
+def normalize_id_col(ids: pd.Series, as_int: bool = False) -> pd.Series:
+    """
+    Whole-column id normalizer.  Numeric ids (e.g. 681035.0) become canonical strings
+    ('681035'); values that are already strings and missing values are left untouched.
+    :param ids: id column, numeric or object dtype
+    :param as_int: return nullable integers (Int64) instead of strings
+    :return: normalized id column
+    """
+    if as_int:
+        return pd.to_numeric(ids, errors="coerce").round().astype(pd.Int64Dtype())
 
-            for idx in range(len(x)):
-                if isinstance(x.iloc[idx], float) and not pd.isnull(x.iloc[idx]):
-                    x.iloc[idx] = str(int(x.iloc[idx]))
+    if pd.api.types.is_numeric_dtype(ids.dtype):
+        # NaN must survive as NaN, so only the non-null values are cast
+        numeric = ids.notna()
+    else:
+        # object columns may hold only numbers, which the .str accessor rejects
+        numeric = ids.notna() & ~ids.map(lambda v: isinstance(v, str))
 
-            return x
-        else:
-            return x
+    if not numeric.any():
+        return ids
 
-    df[["MLBID", "ESPNID"]] = df[["MLBID", "ESPNID"]].apply(float_to_str, axis=1)
+    normalized = ids.astype(object)
+    normalized[numeric] = (pd.to_numeric(ids[numeric]).round().astype(np.int64).astype(str))
 
-    return df
+    return normalized
 
 
 def verify_transform_dir(output_dir=DIR_TRANSFORM):
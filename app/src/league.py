@@ -0,0 +1,140 @@
+"""
+Valuing one cleaned player pool for several leagues
+league.py
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from app.src.mtbl_globals import LG_RULESET, NO_MANAGERS, BUDGET_SPLIT, DIR_TRANSFORM
+from app.src.transformer import Transformer, check_batting_slots
+from app.src.appraiser import Appraiser
+
+
+class League:
+    def __init__(self, name: str, ruleset: dict = None, no_managers: int = None,
+                 budget_split: dict = None, out_dir: str = None):
+        """
+        A league to value the player pool for
+        :param name: league name, unique within a batch
+        :param ruleset: league ruleset, shaped like LG_RULESET; defaults to LG_RULESET
+        :param no_managers: number of managers; defaults to NO_MANAGERS
+        :param budget_split: budget split, shaped like BUDGET_SPLIT; defaults to BUDGET_SPLIT
+        :param out_dir: directory the league's outputs are exported to; defaults to a directory
+            named after the league in DIR_TRANSFORM
+        """
+        self.name = name
+        self.ruleset = ruleset if ruleset is not None else LG_RULESET
+        check_batting_slots(self.ruleset)
+        self.no_managers = no_managers if no_managers is not None else NO_MANAGERS
+        self.budget_split = budget_split if budget_split is not None else BUDGET_SPLIT
+        self.out_dir = out_dir if out_dir is not None else os.path.join(DIR_TRANSFORM, name)
+
+    def transform_key(self) -> str:
+        """
+        :return: key of everything the Transformer depends on; leagues with equal keys share
+            their z-scores and only differ in pricing
+        """
+        return json.dumps([self.no_managers, self.ruleset], sort_keys=True)
+
+
+def read_leagues(path: str) -> list:
+    """
+    Read league configs from a json file: a list of objects with a name and any of ruleset,
+    no_managers, budget_split and out_dir
+    :param path: json file
+    :return: list of League
+    """
+    with open(path) as f:
+        return [League(**config) for config in json.load(f)]
+
+
+def transform_leagues(leagues: list, bats: pd.DataFrame, sps: pd.DataFrame, rps: pd.DataFrame,
+                      parallel: bool = False, max_workers: int | None = None,
+                      low_memory: bool = False) -> dict:
+    """
+    Z-score the cleaned players once per distinct ruleset and league size.  The cleaned frames
+    are shared by every Transformer and are not modified.
+    :param leagues: list of League
+    :param bats: cleaned bats
+    :param sps: cleaned sps
+    :param rps: cleaned rps
+    :param parallel: run the Transformers concurrently in a thread pool
+    :param max_workers: thread pool size when parallel, defaults to one per Transformer
+    :param low_memory: see Transformer
+    :return: League#transform_key -> (Transformer, bats pos groups, arms pos groups)
+    """
+    distinct = {}
+    for league in leagues:
+        distinct.setdefault(league.transform_key(), league)
+
+    def transform(league: League) -> tuple:
+        transformer = Transformer(ruleset=league.ruleset, no_managers=league.no_managers,
+                                  bats=bats, sps=sps, rps=rps, low_memory=low_memory)
+        return transformer, transformer.z_bats(), transformer.z_arms()
+
+    return dict(zip(distinct, map_leagues(transform, distinct.values(), parallel,
+                                          max_workers)))
+
+
+def appraise_leagues(leagues: list, transforms: dict, parallel: bool = False,
+                     max_workers: int | None = None, budget_profiles: dict = None) -> dict:
+    """
+    Price every league's players and materialize its position groups for export
+    :param leagues: list of League
+    :param transforms: output of transform_leagues for the leagues
+    :param parallel: run the Appraisers concurrently in a thread pool
+    :param max_workers: thread pool size when parallel, defaults to one per league
+    :param budget_profiles: profile name -> budget split to also price every league's players
+        with, see Appraiser#price_profiles
+    :return: league name -> pos -> full width Dataframe, sorted on z_total; with
+        budget_profiles, the "profiles" key holds the player x profile price table
+    """
+    names = [league.name for league in leagues]
+    if len(set(names)) != len(names):
+        raise ValueError("League names must be unique.")
+
+    def appraise(league: League) -> dict:
+        transformer, bats, arms = transforms[league.transform_key()]
+        # leagues sharing a transform add their shekel columns to their own shallow copies
+        app = Appraiser(ruleset=league.ruleset,
+                        no_managers=league.no_managers,
+                        budget_split=league.budget_split,
+                        bats=shallow_copy(bats), arms=shallow_copy(arms))
+        app.calculate_league_batting_category_totals()
+        app.calculate_batting_category_weights_shekels()
+        app.calculate_pitching_category_weights_shekels()
+        app.add_skekels()
+        # the transformer only orders the pool and RLP window, full ordering is for export;
+        # groups only hold their computed columns, to_frame joins back the master columns
+        players = {pos: transformer.to_frame(pos, pos_group["players"]).sort_values(
+            "z_total", ascending=False) for pos, pos_group in app.pos_groups.items()}
+        if budget_profiles:
+            players["profiles"] = app.price_profiles(budget_profiles)
+
+        return players
+
+    return dict(zip(names, map_leagues(appraise, leagues, parallel, max_workers)))
+
+
+def shallow_copy(pos_groups: dict) -> dict:
+    """
+    :param pos_groups: pos -> {"players": Dataframe, "rlp": dict}
+    :return: pos_groups with new group dicts and players frames sharing the column data
+    """
+    return {pos: {**group, "players": group["players"].copy(deep=False)}
+            for pos, group in pos_groups.items()}
+
+
+def map_leagues(func, leagues, parallel: bool, max_workers: int | None) -> list:
+    """
+    :return: [func(league) for league in leagues], computed in a thread pool if parallel
+    """
+    leagues = list(leagues)
+    if not parallel or len(leagues) < 2:
+        return [func(league) for league in leagues]
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(leagues)) as pool:
+        return list(pool.map(func, leagues))
@@ -4,50 +4,117 @@ Loader has attributes for combined_bats and combined_arms
 by: pubins.taylor
 date: 13 MAR 2024
 """
+import csv
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 
 from mtbl_iokit import read
 
+from app.src.cleaner import required_columns, to_lean_dtypes
+from app.src.keymap import Crosswalk, file_sha256
+from app.src.memory import frame_bytes
 from app.src.mtbl_globals import ETLType, DIR_EXTRACT
 
 
+# source keys for the join plan and the keymap checks; always read, even when projecting columns
+SOURCE_KEY_COLUMNS = ["espn_id", "PlayerId", "Name", "MLBAMID", "player_id",
+                      "last_name, first_name"]
+
+
 class Loader:
     def __init__(self,
                  keymap: pd.DataFrame,
                  etl_type: ETLType,
-                 extract_dir: str = DIR_EXTRACT):
+                 extract_dir: str = DIR_EXTRACT,
+                 crosswalk: Crosswalk = None,
+                 project_columns: bool = False,
+                 cache_dir: str = None,
+                 chunk_size: int = None,
+                 keymap_report_dir: str = None,
+                 low_memory: bool = False):
         """
         Loader constructor based on where to load data from and the 'shape' it should take (pre
         or reg season)
         :param keymap: pd.DataFrame containing the keymap
         :param etl_type: enum holding the types of extracted data; PRE_SZN or REG_SZN
         :param extract_dir: string path where extracted data will be fetched from
+        :param crosswalk: id crosswalk over the keymap, e.g. KeyMap.crosswalk; built from the
+            keymap if not given
+        :param project_columns: only read and combine the columns that survive cleaning (see
+            cleaner.required_columns), plus the keys needed to join and check the sources
+        :param cache_dir: keep each parsed, typed source frame here as Arrow IPC, keyed by the
+            file's content hash, the ETLType and the columns read; unchanged files are served
+            from the cache.  None disables caching
+        :param chunk_size: stream the Savant files in chunks of this many bytes so peak memory
+            stays bounded; None reads them whole
+        :param keymap_report_dir: write the players that fail a keymap check to parquet sidecar
+            files here; see keymap_checks for the results either way
+        :param low_memory: cast the combined frames to categorical and downcast dtypes, see
+            cleaner.lean_dtypes; frame_bytes records each frame's size before and after
         """
         self.combined_bats = None
         self.combined_arms = None
         self.player_universe = None
+        # file name -> number of completely empty rows dropped at ingest
+        self.empty_rows_dropped = {}
         self.extract_dir = extract_dir
         self.keymap = keymap
+        self.crosswalk = crosswalk
         self.etl_type = etl_type
-
-    def load_extracted_data(self) -> None:
+        self.project_columns = project_columns
+        self.cache_dir = cache_dir
+        # file name -> "hit" or "miss" for the source cache
+        self.cache_status = {}
+        self.chunk_size = chunk_size
+        self.keymap_report_dir = keymap_report_dir
+        # "bats"/"arms" -> source -> KeymapCheck
+        self.keymap_checks = {}
+        self.low_memory = low_memory
+        # frame name -> (bytes before, bytes after) the low-memory cast
+        self.frame_bytes = {}
+
+    def load_extracted_data(self, parallel: bool = False, max_workers: int | None = None) -> None:
         """
         Loads and combines extracted data
+        :param parallel: parse the universe and the four source files concurrently in a thread
+            pool; the combine step runs once every parse is done
+        :param max_workers: thread pool size when parallel, defaults to one per file
         :return: None
         """
         dfs_bats = {}
         dfs_arms = {}
-        self.import_universe()
         # order of keys matters here since SAVANT processing relies on FANGRAPHSID
-        dfs_bats["FANGRAPHS"] = self.import_fangraphs("bats")
-        dfs_bats["SAVANT"] = self.import_savant("bats")
-        dfs_arms["FANGRAPHS"] = self.import_fangraphs("arms")
-        dfs_arms["SAVANT"] = self.import_savant("arms")
+        importers = {"FANGRAPHS": self.import_fangraphs, "SAVANT": self.import_savant}
+
+        if parallel:
+            with ThreadPoolExecutor(max_workers=max_workers or 1 + 2 * len(importers)) as pool:
+                universe = pool.submit(self.import_universe)
+                futures_bats = {source: pool.submit(importer, "bats")
+                                for source, importer in importers.items()}
+                futures_arms = {source: pool.submit(importer, "arms")
+                                for source, importer in importers.items()}
+                universe.result()
+                dfs_bats = {source: future.result() for source, future in futures_bats.items()}
+                dfs_arms = {source: future.result() for source, future in futures_arms.items()}
+        else:
+            self.import_universe()
+            for source, importer in importers.items():
+                dfs_bats[source] = importer("bats")
+            for source, importer in importers.items():
+                dfs_arms[source] = importer("arms")
 
         self.combine_dataframes(dfs_bats, dfs_arms)
+        if self.low_memory:
+            self.combined_bats = self.lean("combined bats", self.combined_bats)
+            self.combined_arms = self.lean("combined arms", self.combined_arms)
 
     # def import_owners(self):
     # TODO:
@@ -57,6 +124,16 @@ class Loader:
     # TODO:
     # pass
 
+    def projected_columns(self, pos: str) -> list | None:
+        """
+        :param pos: bats or arms
+        :return: columns to read for the pos group, None for all columns
+        """
+        if not self.project_columns:
+            return None
+
+        return required_columns(self.etl_type, pos) + SOURCE_KEY_COLUMNS
+
     def import_savant(self, pos) -> pd.DataFrame:
         if pos == "bats":
             int_cols = ['pa', 'n_bolts', 'r_total_stolen_base', 'r_total_caught_stealing']
@@ -65,19 +142,29 @@ class Loader:
                         'p_quality_start', 'p_hold', 'p_starting_p', 'SVHD']
 
         str_cols = ['last_name, first_name', 'player_id', 'year']
-        inverse_float_cols = str_cols + int_cols
+        # every other column is a float
+        schema = {**{col: pd.Int64Dtype() for col in int_cols},
+                  **{col: str for col in str_cols}}
+
+        file_name = pos + "_savant"
+        read_args = (self.extract_dir, file_name, schema, pd.Float64Dtype(),
+                     self.projected_columns(pos))
+        fingerprint = columns_fingerprint(*read_args[2:])
+        if self.chunk_size:
+            df = self.read_source(file_name, ".csv",
+                                  lambda: stream_typed_csv(*read_args, self.chunk_size),
+                                  fingerprint)
+        else:
+            df = self.read_source(file_name, ".csv", lambda: read_typed_csv(*read_args),
+                                  fingerprint)
+
+        # remove completely empty rows, may happen with poorly constructed .csv; streamed reads
+        # drop them chunk by chunk and leave the count in attrs
+        df, empty_rows = drop_empty_rows(df)
+        self.empty_rows_dropped[file_name] = empty_rows + df.attrs.get("empty_rows_dropped", 0)
+        if self.empty_rows_dropped[file_name]:
+            print(f"Dropped {self.empty_rows_dropped[file_name]} empty rows from {file_name}.csv")
 
-        df = read.read_in_as(directory=self.extract_dir,
-                             file_name=pos + "_savant",
-                             file_type=".csv",
-                             as_type=read.IOKitDataTypes.DATAFRAME)
-
-        # remove completely empty rows, may happen with poorly constructed .csv
-        df = df[df.apply(lambda row: not all(row == ''), axis=1)]
-        df = cast_num_columns(df, int_cols, pd.Int64Dtype())
-        float_cols = df.columns[~df.columns.isin(inverse_float_cols)]
-        df = cast_num_columns(df, float_cols, pd.Float64Dtype())
-        df.loc[:, str_cols] = df.loc[:, str_cols].astype(str)
         return df
 
     def import_fangraphs(self, pos) -> pd.DataFrame:
@@ -100,163 +187,507 @@ class Loader:
                 fangraphs_suffix = "_regular_season"
                 str_cols.append("MLBAMID")
 
-        df = read.read_in_as(directory=self.extract_dir,
-                             file_name=pos + fangraphs_suffix,
-                             file_type=".csv",
-                             as_type=read.IOKitDataTypes.DATAFRAME)
+        # unlisted columns stay strings
+        schema = {**{col: pd.Int64Dtype() for col in int_cols + proj_int_cols},
+                  **{col: pd.Float64Dtype() for col in float_cols + proj_float_cols},
+                  **{col: str for col in str_cols}}
 
-        df = cast_num_columns(df, int_cols, pd.Int64Dtype())
-        df = cast_num_columns(df, proj_int_cols, pd.Int64Dtype())
-        df = cast_num_columns(df, float_cols, pd.Float64Dtype())
-        df = cast_num_columns(df, proj_float_cols, pd.Float64Dtype())
-        df[str_cols] = df[str_cols].astype(str)
+        file_name = pos + fangraphs_suffix
+        read_args = (self.extract_dir, file_name, schema, str, self.projected_columns(pos))
+        return self.read_source(file_name, ".csv", lambda: read_typed_csv(*read_args),
+                                columns_fingerprint(*read_args[2:]))
 
-        return df
+    def lean(self, name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Cast df to its lean dtypes and record its size before and after
+        :param name: frame name for frame_bytes
+        :param df: combined frame
+        :return: cast df
+        """
+        lean_df = to_lean_dtypes(df)
+        self.frame_bytes[name] = (frame_bytes(df), frame_bytes(lean_df))
+
+        return lean_df
 
     def import_universe(self):
-        df = read.read_in_as(directory=self.extract_dir,
-                             file_name="espn_player_universe",
-                             file_type=".json",
-                             as_type=read.IOKitDataTypes.DATAFRAME)
+        self.player_universe = self.read_source("espn_player_universe", ".json",
+                                                self.parse_universe)
 
-        player_stats = pd.json_normalize(df["player_stats"])
-        df.drop(columns="player_stats", inplace=True)
-        flat_df = pd.concat([df, player_stats], axis=1)
-        exclude_cols = ["name", "team", "positions", "espn_id", "owner", "ovr"]
-        stat_cols = flat_df.columns[~flat_df.columns.isin(exclude_cols)]
+    def parse_universe(self) -> pd.DataFrame:
+        return read_universe(os.path.join(self.extract_dir, "espn_player_universe.json"))
 
-        if "PRTR" in flat_df.columns:  # PRTR only available for in-season player universe
-            flat_df.rename(columns={col: "prtr_" + col for col in stat_cols}, inplace=True)
+    def read_source(self, file_name: str, file_type: str, parse,
+                    fingerprint: str = "all") -> pd.DataFrame:
+        """
+        Serve a parsed source frame from the cache if the file hasn't changed, otherwise parse it
+        and cache the result.  Records the hit or miss in cache_status.
+        :param file_name: extract file name without extension
+        :param file_type: extension, e.g. .csv
+        :param parse: callable returning the parsed, typed frame
+        :param fingerprint: the columns and dtypes parse reads, see #columns_fingerprint; each
+            fingerprint of a source is cached separately
+        :return: parsed source frame
+        """
+        if self.cache_dir is None:
+            return parse()
 
-        self.player_universe = flat_df
+        source_hash = file_sha256(os.path.join(self.extract_dir, file_name + file_type))
+        key = hashlib.sha256(
+            f"{source_hash}|{self.etl_type.value}|{fingerprint}".encode()).hexdigest()
+        cache_path = os.path.join(
+            self.cache_dir, f"{file_name}.{self.etl_type.value}.{fingerprint}.{key[:16]}.arrow")
+
+        if os.path.exists(cache_path):
+            self.cache_status[file_name] = "hit"
+            return read_arrow_cache(cache_path)
+
+        self.cache_status[file_name] = "miss"
+        df = parse()
+        write_arrow_cache(df, cache_path)
+
+        return df
 
     def combine_dataframes(self, dfs_bats: dict, dfs_arms: dict) -> None:
         """
-        Combines the pos group lists.  Also adds the Player Universe Positions
+        Combines the pos group lists.  Also adds the Player Universe Positions.
+        Join plan: every universe player gets a dense int32 surrogate key, player_key.  Each
+        source is translated to ESPNID once through the crosswalk, then to player_key, and
+        de-duplicated on it; all sources are joined onto the universe in a single index-aligned
+        integer join; no keymap merges, _x/_y columns or row fan-out.  player_key is kept on the
+        combined dfs for the joins and lookups downstream.
         :param dfs_bats: dict of Dataframes for hitters
         :param dfs_arms: dict of Dataframes for pitchers
         :return: None
         """
-
-        def combine_pos_group(pos: dict) -> pd.DataFrame:
-            combined = None
-            universe = self.player_universe
-
+        if self.crosswalk is None:
+            self.crosswalk = Crosswalk(self.keymap)
+
+        universe = self.player_universe.drop_duplicates("espn_id")
+        universe = universe.assign(player_key=np.arange(len(universe), dtype=np.int32))
+        # espn_id -> player_key
+        espn_id_index = pd.Index(universe["espn_id"])
+
+        # keymap rows with a minor league FANGRAPHSID, for the SAVANT keymap check
+        minors_keymap = self.keymap.loc[
+            self.keymap["FANGRAPHSID"].str.startswith("sa", na=False) &
+            self.keymap["MLBID"].notna(), ["MLBID", "FANGRAPHSID", "ESPNID"]]
+
+        def key_source(source: str, df: pd.DataFrame, pos_group: str) -> pd.DataFrame:
+            """
+            Translate a source to player_key and check the keymap for it
+            :return: source df indexed on unique player_key, source key column renamed to its
+                keymap id
+            """
+            match source:
+                case "FANGRAPHS":
+                    source_key = "PlayerId"
+                    keymap_key = "FANGRAPHSID"
+                    valid_eval_cols = df.columns.intersection(["Name", "PlayerId", "MLBAMID"])
+                    keyed_df = df[valid_eval_cols].assign(FANGRAPHSID=self.crosswalk.translate(
+                        df[source_key], src=keymap_key, dst=keymap_key))
+                    checked_col = keymap_key
+                case "SAVANT":
+                    source_key = "player_id"
+                    keymap_key = "MLBID"
+                    keyed_df = df[["last_name, first_name", "player_id"]].merge(
+                        minors_keymap, how="left", left_on=source_key, right_on=keymap_key)
+                    checked_col = "FANGRAPHSID"
+
+            self.keymap_checks.setdefault(pos_group, {})[source] = check_keymap_validity(
+                keyed_df, checked_col, source, pos_group, self.keymap_report_dir)
+
+            espn_ids = self.crosswalk.translate(df[source_key], src=keymap_key, dst="ESPNID")
+            # -1 for players without an ESPNID or outside the universe
+            player_keys = espn_id_index.get_indexer(espn_ids.to_numpy(dtype=object))
+            keep = (player_keys >= 0) & ~pd.Series(player_keys).duplicated().to_numpy()
+
+            return (df[keep]
+                    .rename(columns={source_key: keymap_key})
+                    .set_index(player_keys[keep].astype(np.int32)))
+
+        def combine_pos_group(pos: dict, pos_group: str) -> pd.DataFrame:
             match self.etl_type:
                 case ETLType.PRE_SZN:
                     # TODO: consider adding ESPN projections to the mix
-                    combined = universe[["name", "team", "positions", "espn_id"]]
-                case ETLType.REG_SZN:
-                    combined = universe
-
-            for source, df in pos.items():
-                # Assuming 'source_key' is the column in dfs_bats with the source-specific
-                # primary key Assuming 'combined_key' is the column in keymap with the aligned key
-                match source:
-                    case "FANGRAPHS":
-                        source_key = "PlayerId"
-                        keymap_key = "FANGRAPHSID"
-                        aux_key = "MLBID"  # this will match during merge sequence
-                    case "SAVANT":
-                        source_key = "player_id"
-                        keymap_key = "MLBID"
-                        aux_key = "FANGRAPHSID"
-
-                try:
-                    # add the keys from the keymap, to include ESPN Player Universe Keys
-                    keyed_df = df.merge(self.keymap[[keymap_key, aux_key, "ESPNID"]],
-                                        how="left",
-                                        left_on=source_key,
-                                        right_on=keymap_key)
-
-                    if source == "SAVANT":
-                        # will raise AttributeError if there is a key problem
-                        check_keymap_validity(keyed_df, aux_key, source)
-                    else:
-                        check_keymap_validity(keyed_df, keymap_key, source)
-
-                    # Combine with the existing DataFrame (handles first iteration and subsequent
-                    # ones)
-                    combined = combined.merge(
-                        keyed_df, how="left", left_on="espn_id", right_on="ESPNID") if (
-                            combined is not None) else keyed_df
-                except AttributeError as e:
-                    print(e)
-
-            # column clean up
-            combined["MLBID"] = combined["player_id"]
-            # drop year in REG_SZN but leave in PRE_SZN
-            combined.drop(columns=["MLBID_x", "MLBID_y", "player_id",
-                                   "last_name, first_name"],
-                          inplace=True)
-            combined["FANGRAPHSID"] = combined["PlayerId"]
-            combined.drop(columns=["FANGRAPHSID_x", "FANGRAPHSID_y", "PlayerId", "Name",
-                                   "Team"],
-                          inplace=True)
-            combined["ESPNID"] = combined["espn_id"]
-            combined.drop(columns=["ESPNID_x", "ESPNID_y", "espn_id"],
-                          inplace=True)
-
+                    pos_universe = universe[["name", "team", "positions", "espn_id",
+                                             "player_key"]]
+                case ETLType.REG_SZN if self.project_columns:
+                    pos_universe = universe[universe.columns.intersection(
+                        self.projected_columns(pos_group) + ["player_key"])]
+                case _:
+                    pos_universe = universe
+
+            sources = [key_source(source, df, pos_group) for source, df in pos.items()]
+            combined = pos_universe.join(pd.concat(sources, axis=1), on="player_key")
+
+            # column clean up; the keys go to the back, as MLBID, FANGRAPHSID, ESPNID, player_key
+            drop_cols = ["last_name, first_name", "Name", "Team"]
             match self.etl_type:
                 case ETLType.REG_SZN:
-                    combined.drop(columns=["year"],
-                                  inplace=True)
+                    # drop year in REG_SZN but leave in PRE_SZN
+                    drop_cols.append("year")
+            id_cols = ["MLBID", "FANGRAPHSID", "espn_id", "player_key"]
+            columns = combined.columns.drop(drop_cols + id_cols, errors="ignore").append(
+                pd.Index(id_cols))
 
-            return combined
+            return combined[columns].rename(columns={"espn_id": "ESPNID"})
 
-        # dropna for ESPNID since we don't have those keys and not in the relevant universe
-        # TODO: drop _x/_y columns or combine them earlier
-        self.combined_bats = (combine_pos_group(dfs_bats)
+        # sources only carry players in the universe, so rows without one never show up
+        self.combined_bats = (combine_pos_group(dfs_bats, "bats")
                               .dropna(subset="proj_R")
-                              .drop_duplicates("ESPNID")
                               .drop(columns=["prtr_IP", "prtr_QS", "prtr_ERA", "prtr_WHIP",
                                              "prtr_K/9", "prtr_SVHD"], errors="ignore"))
-        self.combined_arms = (combine_pos_group(dfs_arms)
+        self.combined_arms = (combine_pos_group(dfs_arms, "arms")
                               .dropna(subset="proj_IP")
-                              .drop_duplicates("ESPNID")
                               .drop(columns=["prtr_R", "prtr_HR", "prtr_RBI", "prtr_SBN",
                                              "prtr_OBP", "prtr_SLG"], errors="ignore"))
 
 
-def check_keymap_validity(df: pd.DataFrame, id_col: str, source: str) -> None:
+class KeymapCheck:
+    def __init__(self, source: str, message: str, offenders: dict, pos_group: str = None):
+        """
+        Result of a keymap check for one source.  Holds the offending players as id arrays; the
+        text report is only rendered when asked for.
+        :param source: SAVANT, FANGRAPHS
+        :param message: what is wrong with the offending players
+        :param offenders: column name -> np.ndarray of the offending players' values
+        :param pos_group: bats or arms, if the source belongs to one
+        """
+        self.source = source
+        self.pos_group = pos_group
+        self.message = message
+        self.offenders = offenders
+        self.count = len(next(iter(offenders.values()), ()))
+        self._report = None
+
+    def __bool__(self) -> bool:
+        """
+        :return: True if the keymap is valid for the source
+        """
+        return self.count == 0
+
+    def ids(self, col: str) -> np.ndarray:
+        """
+        :param col: id column, e.g. PlayerId or player_id
+        :return: the offending players' ids
+        """
+        return self.offenders[col]
+
+    def report(self) -> str:
+        """
+        Renders (once) the full text report of the offending players
+        :return: report string, empty if the keymap is valid
+        """
+        if self._report is None:
+            self._report = "" if not self.count else "Keymap Error: {}:\n{}".format(
+                self.message, pd.DataFrame(self.offenders).to_string())
+
+        return self._report
+
+    def summary(self) -> str:
+        """
+        :return: one line summary, cheap to build
+        """
+        label = self.source if self.pos_group is None else f"{self.source} ({self.pos_group})"
+        return f"Keymap Error: {label}: {self.count} players. {self.message}"
+
+    def write(self, report_dir: str) -> str:
+        """
+        Writes the offending players to a parquet sidecar file
+        :param report_dir: directory for the sidecar file
+        :return: path of the sidecar file
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        label = ".".join(filter(None, [self.pos_group, self.source.lower()]))
+        path = os.path.join(report_dir, f"keymap_check.{label}.parquet")
+        # nullable strings, so missing ids stay null instead of becoming "None" or "nan"
+        pd.DataFrame(self.offenders).astype("string").to_parquet(path, index=False)
+
+        return path
+
+
+def check_keymap_validity(df: pd.DataFrame, id_col: str, source: str, pos_group: str = None,
+                          report_dir: str = None) -> KeymapCheck:
     """
     Checks if the keymap is valid.
     Savant data is only available from pro players which means a savant df cannot have a 'sa' prefix
      in the FANGRAPHSID column.
     Fangraphs data for projections cannot have an empty value after merging with keymap; this means
      player is not in my keymap.
+    A single mask per source; only a one line summary is printed, the full report is rendered
+     lazily by KeymapCheck.report().
     :param df: dataframe to check, typically savant keyed df.
     :param id_col: the name of the column to check
     :param source: SAVANT, FANGRAPHS
-    :raise: AttributeError if players have bad keys
-    :return:
+    :param pos_group: bats or arms, labels the result and sidecar file
+    :param report_dir: if given and players have bad keys, write them to a sidecar file here
+    :return: KeymapCheck holding the count and ids of the players with bad keys
     """
-    problematic_players = None
-    error_source = ""
     match source:
         case "FANGRAPHS":
-            valid_eval_cols = df.columns.intersection(["Name", "PlayerId", "MLBAMID"])
-            problematic_players = df[df[id_col].isna()][valid_eval_cols]
-            error_source = "Player shows up in FANGRAPHS data, but not in KeyMap.\n"
+            eval_cols = df.columns.intersection(["Name", "PlayerId", "MLBAMID"])
+            bad = df[id_col].isna().to_numpy()
+            message = "Player shows up in FANGRAPHS data, but not in KeyMap."
         case "SAVANT":
             # FANGRAPHSID cannot start with 'sa' and be found in the savant data.
-            no_nas_df = df[df[id_col].notna()]
-            problematic_players = no_nas_df[no_nas_df["FANGRAPHSID"].str.startswith(
-                'sa')][["last_name, first_name", "player_id", "FANGRAPHSID", "ESPNID"]]
-            error_source = ("Players found in SAVANT but have a minor league FANGRAPHS ID, "
-                            "update with pro-FANGRAPHSID.\n")
+            eval_cols = ["last_name, first_name", "player_id", "FANGRAPHSID", "ESPNID"]
+            bad = df[id_col].str.startswith("sa", na=False).to_numpy()
+            message = ("Players found in SAVANT but have a minor league FANGRAPHS ID, "
+                       "update with pro-FANGRAPHSID.")
+        case _:
+            raise ValueError(f"No keymap check for source {source}")
+
+    result = KeymapCheck(source, message,
+                         {col: df[col].to_numpy()[bad] for col in eval_cols}, pos_group)
+
+    if result.count:
+        summary = result.summary()
+        if report_dir is not None:
+            summary += f" Details: {result.write(report_dir)}"
+        print(summary)
+        # raise AttributeError(result.report())
+
+    return result
+
+
+def read_typed_csv(directory: str, file_name: str, schema: dict, default_type,
+                   usecols: list = None) -> pd.DataFrame:
+    """
+    Reads a .csv with the pyarrow parser so columns come out already typed; no intermediate
+    all-string frame or cast copies.  Empty string cells stay '' in string columns and are NA in
+    numeric columns, the same as reading as strings then #cast_num_columns.  If the parser
+    rejects a value (e.g. '152.0' in an int column), falls back to exactly that path.
+    :param directory: where the file lives
+    :param file_name: file name without the .csv extension
+    :param schema: column name -> pd.Int64Dtype(), pd.Float64Dtype() or str
+    :param default_type: type for columns not in the schema
+    :param usecols: only parse these columns (those in the file), None for all
+    :return: typed DataFrame
+    """
+    path = os.path.join(directory, file_name + ".csv")
+    convert_options = typed_convert_options(path, schema, default_type, usecols)
+
+    try:
+        table = pacsv.read_csv(path, convert_options=convert_options)
+    except pa.ArrowInvalid:
+        header = convert_options.include_columns
+        df = read.read_in_as(directory=directory,
+                             file_name=file_name,
+                             file_type=".csv",
+                             as_type=read.IOKitDataTypes.DATAFRAME)[header]
+        for astype in [pd.Int64Dtype(), pd.Float64Dtype()]:
+            cols = [col for col in header if schema.get(col, default_type) == astype]
+            df = cast_num_columns(df, cols, astype)
+        return df
+
+    return arrow_to_typed_frame(table)
+
+
+def stream_typed_csv(directory: str, file_name: str, schema: dict, default_type,
+                     usecols: list = None, chunk_size: int = 1 << 20) -> pd.DataFrame:
+    """
+    Bounded-memory version of #read_typed_csv for large files.  The file is parsed in chunks of
+    chunk_size bytes; each chunk is typed and has its empty rows filtered out before the next is
+    read, and the kept chunks become one frame at the end.  Returns the same frame as
+    #read_typed_csv followed by #drop_empty_rows, the number of empty rows is in
+    df.attrs["empty_rows_dropped"].  A value the typed parser rejects falls back to reading the
+    whole file, which is printed; other parse errors are raised.
+    :param directory: where the file lives
+    :param file_name: file name without the .csv extension
+    :param schema: column name -> pd.Int64Dtype(), pd.Float64Dtype() or str
+    :param default_type: type for columns not in the schema
+    :param usecols: only parse these columns (those in the file), None for all
+    :param chunk_size: bytes per parsed chunk
+    :return: typed DataFrame without empty rows
+    """
+    path = os.path.join(directory, file_name + ".csv")
+    convert_options = typed_convert_options(path, schema, default_type, usecols)
+    batches = []
+    kept_rows = []
+    offset = 0
+
+    try:
+        with pacsv.open_csv(path, read_options=pacsv.ReadOptions(block_size=chunk_size),
+                            convert_options=convert_options) as reader:
+            for batch in reader:
+                keep = pc.invert(arrow_empty_rows(batch))
+                batches.append(batch.filter(keep))
+                kept_rows.append(np.flatnonzero(keep.to_numpy(zero_copy_only=False)) + offset)
+                offset += batch.num_rows
+            arrow_schema = reader.schema
+    except pa.ArrowInvalid as err:
+        # only a value the typed parser rejects (e.g. '152.0' in an int column) takes the
+        # #read_typed_csv fallback, which reads the whole file; malformed files still raise
+        if "CSV conversion error" not in str(err):
+            raise
+        print(f"Streaming {file_name}.csv fell back to a whole-file read: {err}")
+        df, num_empty = drop_empty_rows(read_typed_csv(directory, file_name, schema,
+                                                       default_type, usecols))
+        df.attrs["empty_rows_dropped"] = num_empty
+        return df
+
+    df = arrow_to_typed_frame(pa.Table.from_batches(batches, schema=arrow_schema))
+    kept_rows = np.concatenate(kept_rows) if kept_rows else np.array([], dtype=np.int64)
+    if len(kept_rows) < offset:
+        # keep the row labels of the dropped-rows frame
+        df.index = pd.Index(kept_rows)
+    df.attrs["empty_rows_dropped"] = offset - len(kept_rows)
+
+    return df
+
+
+def typed_convert_options(path: str, schema: dict, default_type,
+                          usecols: list = None) -> pacsv.ConvertOptions:
+    """
+    :param path: .csv file
+    :param schema: column name -> pd.Int64Dtype(), pd.Float64Dtype() or str
+    :param default_type: type for columns not in the schema
+    :param usecols: only parse these columns (those in the file), None for all
+    :return: pyarrow convert options with every read column typed
+    """
+    arrow_types = {pd.Int64Dtype(): pa.int64(), pd.Float64Dtype(): pa.float64(), str: pa.string()}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f))
+    if usecols is not None:
+        usecols = set(usecols)
+        header = [col for col in header if col in usecols]
+
+    return pacsv.ConvertOptions(
+        column_types={col: arrow_types[schema.get(col, default_type)] for col in header},
+        include_columns=header,
+        strings_can_be_null=False,
+        quoted_strings_can_be_null=False)
+
+
+def arrow_to_typed_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    :param table: parsed .csv
+    :return: DataFrame with Int64/Float64 numeric columns and object string columns
+    """
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype(),
+                                         pa.float64(): pd.Float64Dtype()}.get)
+
+
+def arrow_empty_rows(batch: pa.RecordBatch) -> pa.Array:
+    """
+    Arrow counterpart of #drop_empty_rows' test: every string column is '' and every other
+    column is null
+    :param batch: typed record batch
+    :return: boolean array, True for empty rows
+    """
+    empty = pa.array(np.ones(batch.num_rows, dtype=bool))
+    for column in batch.columns:
+        if pa.types.is_string(column.type):
+            empty = pc.and_(empty, pc.equal(column, ""))
+        else:
+            empty = pc.and_(empty, pc.is_null(column))
+
+    return empty
+
+
+def drop_empty_rows(df: pd.DataFrame) -> (pd.DataFrame, int):
+    """
+    Columnar empty-row detector for typed frames: a row is empty when every string column is ''
+    and every other column is NA.
+    :param df: typed DataFrame
+    :return: DataFrame without the empty rows, number of rows dropped
+    """
+    is_str = (df.dtypes == object).to_numpy()
+    empty_rows = (df.loc[:, is_str].eq('').all(axis=1) &
+                  df.loc[:, ~is_str].isna().all(axis=1))
+    num_empty = int(empty_rows.sum())
+
+    return (df[~empty_rows] if num_empty else df), num_empty
+
+
+def read_universe(path: str) -> pd.DataFrame:
+    """
+    Reads the ESPN player universe straight into typed Arrow columns.  The nested player_stats
+    structs are flattened into columns after the player columns (prefixed with prtr_ for the
+    in-season Player Rater), so there is no object frame of dicts to json_normalize, drop and
+    concat.  positions stays a list per player and espn_id is the string key.
+    :param path: espn_player_universe.json
+    :return: flat player universe
+    """
+    with open(path) as f:
+        # one struct per player, its fields the union of keys in order of first appearance
+        table = pa.Table.from_struct_array(pa.array(json.load(f)))
+
+    if "player_stats" in table.column_names:
+        stats = pa.Table.from_struct_array(table.column("player_stats").combine_chunks())
+        table = table.drop_columns("player_stats")
+        # PRTR only available for in-season player universe
+        prefix = "prtr_" if "PRTR" in stats.column_names else ""
+        for stat, column in zip(stats.column_names, stats.columns):
+            table = table.append_column(prefix + stat, column)
+
+    return arrow_to_list_frame(table)
+
+
+def columns_fingerprint(schema: dict, default_type, usecols: list = None) -> str:
+    """
+    :param schema: column name -> pd.Int64Dtype(), pd.Float64Dtype() or str
+    :param default_type: type for columns not in the schema
+    :param usecols: the parsed columns, None for all
+    :return: short hash of the requested columns and their dtypes
+    """
+    columns = [sorted(usecols) if usecols is not None else None,
+               sorted((col, str(dtype)) for col, dtype in schema.items()), str(default_type)]
+
+    return hashlib.sha256(json.dumps(columns).encode()).hexdigest()[:8]
+
+
+def read_arrow_cache(path: str) -> pd.DataFrame:
+    """
+    Memory-maps a cached Arrow IPC file back into a DataFrame
+    :param path: cache file
+    :return: the frame as it was cached, list columns as python lists
+    """
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    return arrow_to_list_frame(table)
+
+
+def arrow_to_list_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    :param table: Arrow table
+    :return: DataFrame with list columns as python lists rather than numpy arrays
+    """
+    df = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_list(field.type):
+            df[field.name] = table.column(field.name).to_pylist()
+
+    return df
+
+
+def write_arrow_cache(df: pd.DataFrame, path: str) -> None:
+    """
+    Writes a frame to an Arrow IPC file, replacing older cache files for the same source, ETLType
+    and columns fingerprint
+    :param df: parsed source frame
+    :param path: cache file, named <source>.<etl type>.<fingerprint>.<key>.arrow
+    :return: None
+    """
+    cache_dir, cache_file = os.path.split(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    source = cache_file.split(".")[:3]
+    for old_file in os.listdir(cache_dir):
+        if old_file.split(".")[:3] == source and old_file.endswith(".arrow"):
+            os.remove(os.path.join(cache_dir, old_file))
 
-    if not problematic_players.empty:
-        error_msg = "Keymap Error: {}:\n{}".format(error_source,
-                                                   problematic_players.to_string()
-                                                   )
-        print(error_msg)
-        # raise AttributeError(error_msg)
+    table = pa.Table.from_pandas(df)
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
 
 
 def cast_num_columns(df, cols, astype) -> pd.DataFrame:
     cast_cols = df.columns.intersection(cols)
-    cast_df = df.copy()
+    # under copy-on-write a shallow copy is enough, the cast columns are replaced not mutated
+    cast_df = df.copy(deep=not pd.options.mode.copy_on_write)
     cast_df[cast_cols] = cast_df[cast_cols].apply(pd.to_numeric, errors="coerce").astype(
         astype)
 
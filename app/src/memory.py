@@ -0,0 +1,118 @@
+"""
+Peak memory (RSS) bookkeeping for the pipeline stages
+memory.py
+"""
+import resource
+import sys
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class StageMemory:
+    def __init__(self):
+        """
+        Records the peak RSS of each pipeline stage.  Where the OS allows it (Linux) the peak is
+        reset before each stage so every stage reports its own high-water mark; elsewhere the
+        process high-water mark at the end of the stage is recorded.
+        """
+        # stage name -> (peak RSS MB, RSS growth MB over the previous stage's peak)
+        self.stages = {}
+        self.resettable = reset_peak_rss()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure the peak RSS of the code run inside the with block
+        :param name: stage name for the report
+        """
+        self.resettable = reset_peak_rss()
+        start = peak_rss_mb()
+        yield
+        peak = peak_rss_mb()
+        self.stages[name] = (peak, peak - start)
+
+    def report(self) -> str:
+        """
+        :return: one line per stage with its peak RSS
+        """
+        kind = "peak" if self.resettable else "high-water"
+        lines = [f"{'stage':<12}{kind + ' RSS MB':>16}{'growth MB':>12}"]
+        for name, (peak, growth) in self.stages.items():
+            lines.append(f"{name:<12}{peak:>16.1f}{growth:>12.1f}")
+
+        return "\n".join(lines)
+
+
+def compare_report(baseline: StageMemory, optimized: StageMemory,
+                   labels: tuple = ("default", "cow")) -> str:
+    """
+    :param baseline: stage peaks of the baseline run
+    :param optimized: stage peaks of the optimized run, for the same stages
+    :param labels: names of the two runs for the column headers
+    :return: one line per stage with both runs' peak RSS and RSS growth, and the optimized
+        run's change in each
+    """
+    base, opt = labels
+    headers = [f"{base} peak MB", f"{opt} peak MB", "delta MB",
+               f"{base} growth MB", f"{opt} growth MB", "delta MB"]
+    lines = [f"{'stage':<12}" + "".join(f"{header:>20}" for header in headers)]
+    for name, (base_peak, base_growth) in baseline.stages.items():
+        opt_peak, opt_growth = optimized.stages[name]
+        columns = [base_peak, opt_peak, opt_peak - base_peak,
+                   base_growth, opt_growth, opt_growth - base_growth]
+        lines.append(f"{name:<12}" + "".join(f"{mb:>20.1f}" for mb in columns))
+
+    return "\n".join(lines)
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """
+    :param df: any frame
+    :return: bytes held by df, including the index and the contents of object columns
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def frame_bytes_report(frames: dict) -> str:
+    """
+    :param frames: frame name -> (bytes before, bytes after), e.g. Cleaner.frame_bytes
+    :return: one line per frame with its size before and after and the ratio
+    """
+    lines = [f"{'frame':<16}{'before KiB':>12}{'after KiB':>12}{'ratio':>8}"]
+    for name, (before, after) in frames.items():
+        lines.append(f"{name:<16}{before / 1024:>12.1f}{after / 1024:>12.1f}"
+                     f"{after / before if before else 1:>8.2f}")
+
+    return "\n".join(lines)
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: peak resident set size of this process in MB; VmHWM on Linux so it honors
+        reset_peak_rss, ru_maxrss elsewhere
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the process peak RSS to the current RSS (Linux only)
+    :return: True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
@@ -47,6 +47,40 @@ LG_RULESET = {
         }
     }
 }
+# share of the draft budget for each group, and each group's split over its categories
+BUDGET_SPLIT = {
+    "bats": {
+        "ovr": 0.65,
+        "cats": {
+            "HR": 0.20,
+            "R": 0.15,
+            "RBI": 0.10,
+            "SBN": 0.15,
+            "OBP": 0.20,
+            "SLG": 0.20
+        }
+    },
+    "sps": {
+        "ovr": 0.20,
+        "cats": {
+            "IP": 0.15,
+            "QS": 0.20,
+            "ERA": 0.20,
+            "WHIP": 0.20,
+            "K/9": 0.25
+        }
+    },
+    "rps": {
+        "ovr": 0.15,
+        "cats": {
+            "IP": 0.15,
+            "SVHD": 0.20,
+            "ERA": 0.20,
+            "WHIP": 0.20,
+            "K/9": 0.25
+        }
+    }
+}
 
 
 class ETLType(Enum):
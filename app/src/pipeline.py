@@ -0,0 +1,76 @@
+"""
+The load, clean, transform, appraise and export pipeline run by app.__main__
+pipeline.py
+"""
+import os
+from contextlib import nullcontext
+
+import pandas as pd
+
+from mtbl_iokit.write import export_dataframe
+from app.src.mtbl_globals import ETLType, DIR_TRANSFORM
+from app.src.keymap import KeyMap
+from app.src.loader import Loader
+from app.src.cleaner import Cleaner
+from app.src.league import League, transform_leagues, appraise_leagues
+from app.src.memory import StageMemory, frame_bytes_report
+
+
+def measure_pipeline(copy_on_write: bool, *pipeline_args) -> StageMemory:
+    """
+    :param copy_on_write: see app.__main__.main
+    :param pipeline_args: run_pipeline args, without memory
+    :return: the peak RSS of each stage of one pipeline run
+    """
+    memory = StageMemory()
+    with pd.option_context("mode.copy_on_write", copy_on_write):
+        run_pipeline(*pipeline_args, memory=memory)
+
+    return memory
+
+
+def run_pipeline(etl_type: ETLType, parallel_load: bool, source_cache: str,
+                 low_memory: bool = False, leagues: list = None, parallel_leagues: bool = False,
+                 budget_profiles: dict = None, memory: StageMemory = None):
+    """
+    Load and clean once, then transform, appraise and export for each league
+    :param low_memory: see app.__main__.main
+    :param leagues: see app.__main__.main
+    :param parallel_leagues: see app.__main__.main
+    :param budget_profiles: see app.__main__.main
+    :param memory: StageMemory to record each stage's peak RSS in, None to skip measuring
+    """
+    leagues = leagues or [League("mtbl", out_dir=DIR_TRANSFORM)]
+
+    def stage(name: str):
+        return memory.stage(name) if memory is not None else nullcontext()
+
+    with stage("load"):
+        km = KeyMap(primary_key="FANGRAPHSID")  # object has keymap and crosswalk attributes
+        loader = Loader(keymap=km.keymap, etl_type=etl_type, crosswalk=km.crosswalk,
+                        project_columns=True, cache_dir=source_cache,
+                        low_memory=low_memory)  # object has combined dfs
+        loader.load_extracted_data(parallel=parallel_load)
+    if source_cache:
+        print(f"Source cache: {loader.cache_status}")
+    # clean data
+    with stage("clean"):
+        cleaner = Cleaner(etl_type=etl_type, bats=loader.combined_bats, arms=loader.combined_arms,
+                          low_memory=low_memory)
+        clean_bats = cleaner.clean_hitters()
+        clean_sps, clean_rps = cleaner.clean_pitchers()
+    if low_memory:
+        print(frame_bytes_report({**loader.frame_bytes, **cleaner.frame_bytes}))
+    # standardize datasets, once per distinct ruleset and league size
+    with stage("transform"):
+        transforms = transform_leagues(leagues, clean_bats, clean_sps, clean_rps,
+                                       parallel=parallel_leagues, low_memory=low_memory)
+    with stage("appraise"):
+        league_players = appraise_leagues(leagues, transforms, parallel=parallel_leagues,
+                                          budget_profiles=budget_profiles)
+
+    with stage("export"):
+        for league in leagues:
+            os.makedirs(league.out_dir, exist_ok=True)
+            for key, players in league_players[league.name].items():
+                export_dataframe(players, "mtbl_" + key.lower(), ".json", league.out_dir)
@@ -9,24 +9,53 @@ import numpy as np
 import pandas as pd
 import math
 
+from app.src.cleaner import (POSITION_BITS, encode_positions, eligible, listed_first,
+                              multi_eligible)
+
+# categories where a lower projection is better
+LOWER_IS_BETTER = ["proj_ERA", "proj_WHIP"]
+# replacement level players are the RLP_WINDOW players right after the draftable pool
+RLP_WINDOW = 5
+# besides the scored proj_ columns, the columns the z-score and pricing passes work on; the
+# other columns stay in the master tables and are joined back at export, see #to_frame
+WORK_COLUMNS = ["ESPNID", "player_key", "positions", "pos_mask", "proj_wRC+"]
+# internal columns that are not exported: the surrogate key and the positional bitmask
+INTERNAL_COLUMNS = ["player_key", "pos_mask"]
+
 
 class Transformer:
     def __init__(self, ruleset: dict, no_managers: int, bats: pd.DataFrame, sps: pd.DataFrame,
-                 rps: pd.DataFrame):
+                 rps: pd.DataFrame, low_memory: bool = False):
         """
         :param ruleset: League specific ruleset
         :param no_managers: Number of managers, establishes the RLP threshold
-        :param bats: Dataframe with hitters
+        :param bats: Dataframe with hitters; pos_mask (see cleaner.encode_positions) is added if
+            the cleaner did not already
         :param sps: Dataframe with pitchers
         :param rps: Dataframe with pitchers
+        :param low_memory: store pri_pos as a categorical; the z-score maths runs in float64
+            whatever the dtypes of the given frames
+
+        The given frames are kept as master tables.  Position groups only carry a master_row
+        pointer into their master, the WORK_COLUMNS and the scored proj_ columns, plus the z (and
+        later shekel) columns computed for them; #to_frame joins the rest back for export.
+        Players are joined and looked up on the int32 player_key the Loader assigns; masters
+        without one get it from their ESPNIDs.
         """
+        check_batting_slots(ruleset)
         self.ruleset = ruleset
         self.batting_categories = ruleset["SCORING"]["BATTING"]
         self.pitching_categories = ruleset["SCORING"]["PITCHING"]
         self.no_managers = no_managers
-        self.bats = bats
-        self.sps = sps
-        self.rps = rps
+        self.pri_pos_dtype = (pd.CategoricalDtype(list(ruleset["ROSTER_REQS"]["BATTERS"]))
+                              if low_memory else None)
+        if "pos_mask" not in bats.columns:
+            bats = bats.assign(pos_mask=encode_positions(bats["positions"]))
+        self.masters = {pos: with_player_key(master) for pos, master in
+                        {"bats": bats, "SP": sps, "RP": rps}.items()}
+        self.bats = work_table(self.masters["bats"], self.batting_categories)
+        self.sps = work_table(self.masters["SP"], self.pitching_categories)
+        self.rps = work_table(self.masters["RP"], self.pitching_categories)
 
     def z_bats(self) -> dict:
         """
@@ -35,59 +64,72 @@ class Transformer:
         :return: dict keyed by the pos
         """
         pos_groups = self.calc_initial_rlp_bats()
+        # DH pool is kept as a set of players; the DH frame is only built when it is z-scored
+        dh_pool = PlayerPool(pos_groups["DH"]["players"])
 
         for pos, group in pos_groups.items():
+            if pos == "DH":
+                group["players"] = dh_pool.to_frame()
             # first z-score setting is with group sorted on proj_wRC+
             pos_groups[pos]["players"] = self.calculate_z_scores(df=group["players"],
                                                                  rlp_dict=group["rlp"],
                                                                  pos=pos,
                                                                  categories=self.batting_categories)
             if pos != "DH":
-                pos_groups["DH"]["players"] = self.cleanup_dh_pos_group(pos_groups=pos_groups,
-                                                                        pos=pos)
+                # the top players at the position are not DH candidates
+                dh_pool.remove(pos_groups[pos]["players"]["player_key"][
+                               :self.get_players_at_pos(pos)])
         # no dups in DH at this point
         pos_groups = self.set_pri_pos(pos_groups)
         assert list(pos_groups.keys())[-1] == "DH"
+        dh_pool = PlayerPool(pos_groups["DH"]["players"])
 
         for pos, group in pos_groups.items():
+            if pos == "DH":
+                group["players"] = dh_pool.to_frame()
             # set new column for primary position
             group["players"]["pri_pos"] = pos
+            if self.pri_pos_dtype is not None:
+                group["players"]["pri_pos"] = group["players"]["pri_pos"].astype(
+                    self.pri_pos_dtype)
             if pos == "DH":
                 # sort on z_total is irrelevant for DH, resort on proj_wRC+
-                group["players"].sort_values(by="proj_wRC+", ascending=False, inplace=True)
+                group["players"] = select_top(group["players"], "proj_wRC+",
+                                              self.get_players_at_pos(pos) + RLP_WINDOW)
 
             rlp_group = self.rlp_group(df=pos_groups[pos]["players"], pos=pos)
-            rlp = reduce_rlp_group(rlp_group)
-            # second z-score setting is with group sorted on z_total
-            pos_groups[pos]["players"] = self.calculate_z_scores(df=group["players"],
-                                                                 rlp_dict=rlp,
-                                                                 pos=pos,
-                                                                 categories=self.batting_categories)
+            rlp = reduce_rlp_group(rlp_group, self.batting_categories)
+            # second z-score setting is with group sorted on z_total; only the pool and the RLP
+            # window need ordering from here on
+            pos_groups[pos]["players"] = self.calculate_z_scores(
+                df=group["players"], rlp_dict=rlp, pos=pos, categories=self.batting_categories,
+                top_k=self.get_players_at_pos(pos) + RLP_WINDOW)
 
             if pos != "DH":
                 # after z-scores are recalculated, set the final RLP group for addition to DH
-                rlp_group = self.rlp_group(df=pos_groups[pos]["players"], pos=pos)
-                pos_groups["DH"]["players"] = pd.concat([pos_groups["DH"]["players"], rlp_group])
-                pos_groups["DH"]["players"] = self.cleanup_dh_pos_group(pos_groups=pos_groups,
-                                                                        pos=pos)
+                dh_pool.add(self.rlp_group(df=pos_groups[pos]["players"], pos=pos))
+                dh_pool.remove(pos_groups[pos]["players"]["player_key"][
+                               :self.get_players_at_pos(pos)])
 
         return pos_groups
 
-    def cleanup_dh_pos_group(self, pos_groups: dict, pos: str) -> pd.DataFrame:
+    def to_frame(self, pos: str, players: pd.DataFrame) -> pd.DataFrame:
         """
-        After the position groups are sorted by total_z scores, the top players at each position
-        need to be removed from the DH group
-        :param pos_groups: all the position groups with players and rlp keys
-        :param pos: str for pos to comb through
-        :return: Dataframe of DH group
+        Materialize a position group: its players' master rows, less the INTERNAL_COLUMNS,
+        followed by the columns computed for the group (z-scores, z_total, pri_pos, shekels)
+        :param pos: position of the group, selects the master table
+        :param players: position group players, with master_row
+        :return: full width Dataframe in the players' order
         """
-        num_players = self.get_players_at_pos(pos)
-        top_players_at_pos = pos_groups[pos]["players"][:num_players]
-        dh_players = pos_groups["DH"]["players"]
-        no_dups_dh = dh_players[~dh_players["ESPNID"].isin(top_players_at_pos["ESPNID"])]
-        no_dups_dh.drop_duplicates(subset="ESPNID", keep="first", inplace=True)
+        master = self.masters[pos if pos in ["SP", "RP"] else "bats"]
+        # the string ids are the exported keys and positions the exported eligibility
+        export_columns = master.columns.drop(INTERNAL_COLUMNS, errors="ignore")
+        wide = master.iloc[players["master_row"].to_numpy(),
+                           master.columns.get_indexer(export_columns)].reset_index(drop=True)
+        computed = players.columns.difference(master.columns.append(pd.Index(["master_row"])),
+                                              sort=False)
 
-        return no_dups_dh
+        return pd.concat([wide, players[computed].reset_index(drop=True)], axis=1)
 
     def calc_initial_rlp_bats(self, sort_stat: str = "proj_wRC+") -> dict:
         """
@@ -99,7 +141,10 @@ class Transformer:
         :return: position group dictionary; keys are positions, each position has a pos group and
         RLP dict
         """
+        if sort_stat not in self.bats.columns:
+            self.bats[sort_stat] = self.masters["bats"][sort_stat].to_numpy()
         bats = {"DH": {"players": pd.DataFrame(), "rlp": dict}}
+        dh_candidates = []
 
         for roster_slot, pos_req in self.ruleset["ROSTER_REQS"]["BATTERS"].items():
             # instantiate the dict
@@ -108,25 +153,26 @@ class Transformer:
 
             # DH is last position, fill up RLP players into the DH df.
             if roster_slot != "DH":
-                bats[roster_slot]["players"] = self.bats[self.bats["positions"].apply(lambda pos:
-                                                                                      roster_slot in
-                                                                                      pos)]
+                bats[roster_slot]["players"] = self.bats[eligible(self.bats["pos_mask"],
+                                                                  roster_slot)]
                 rlp_group = self.rlp_group(bats[roster_slot]["players"], roster_slot)
-                bats["DH"]["players"] = pd.concat([bats["DH"]["players"], rlp_group])
+                dh_candidates.append(rlp_group)
             else:
-                # only one position and it equals DH
-                only_dh = self.bats[self.bats["positions"].apply(lambda pos: "DH" in pos[0])]
-                bats["DH"]["players"] = pd.concat([bats["DH"]["players"], only_dh])
-                # since this is all the RLPs from other positions, resort on proj stat
-                bats["DH"]["players"].sort_values(by=sort_stat, ascending=False, inplace=True)
+                # first listed position is DH
+                dh_candidates.append(self.bats[listed_first(self.bats["pos_mask"], "DH")])
+                # since this is all the RLPs from other positions, resort on proj stat; the
+                # whole pool is sorted since the position groups' top players are removed from
+                # it before the DH pool is z-scored
+                bats["DH"]["players"] = pd.concat(dh_candidates).sort_values(
+                    sort_stat, ascending=False, kind="stable")
                 rlp_group = self.rlp_group(bats["DH"]["players"], roster_slot)
 
-            bats[roster_slot]["rlp"] = reduce_rlp_group(rlp_group)
+            bats[roster_slot]["rlp"] = reduce_rlp_group(rlp_group, self.batting_categories)
 
         # remove from front of dict
         dh = bats.pop("DH")
         # remove any duplicate players
-        dh["players"] = dh["players"].drop_duplicates(subset="ESPNID")
+        dh["players"] = dh["players"].drop_duplicates(subset="player_key")
         # append to back of dict
         bats["DH"] = dh
 
@@ -148,32 +194,53 @@ class Transformer:
         This provides the greatest positional flexibility and maximizes the potential return
         value of the player.
         """
-        pos_groups = pos_groups.copy()
         pos_list = list(pos_groups.keys())
-        for i in range(0, len(pos_list)):
-            pos_i = pos_list[i]
-            bats = pos_groups[pos_i]["players"]
-            for player in bats.itertuples():
-                positions = player.positions
-                if len(positions) > 1:
-                    for alt_pos in positions:
-                        if pos_i != alt_pos and alt_pos != "SP":
-                            match = pos_groups[alt_pos]["players"][
-                                pos_groups[alt_pos]["players"]["ESPNID"] == player.ESPNID]
-                            if len(match) == 0:
-                                continue
-                            # #Index used since itertuples, unwrapping required for direct index
-                            current_pos_group_player_idx = math.ceil(
-                                player.Index / self.ruleset["ROSTER_REQS"]["BATTERS"][pos_i])
-                            match_idx = math.ceil(match.index[0] /
-                                                  self.ruleset["ROSTER_REQS"]["BATTERS"][alt_pos])
-                            # drop the player from the group for the lower ranking
-                            if current_pos_group_player_idx < match_idx:
-                                match_index = match.index[0]  # Assuming single match
-                                pos_groups[alt_pos]["players"].drop(match_index, inplace=True)
-                            else:
-                                pos_groups[pos_i]["players"].drop(player.Index, inplace=True)
-                            break
+        slots = self.ruleset["ROSTER_REQS"]["BATTERS"]
+        frames = [pos_groups[pos]["players"] for pos in pos_list]
+        key = player_key_column(frames[0])
+        players = pd.concat([df[[key, "positions"]] for df in frames], ignore_index=True)
+        players = players[~players[key].duplicated()].reset_index(drop=True)
+        ids = pd.Index(players[key])
+        n, k = len(players), len(pos_list)
+        rows = np.arange(n)
+
+        # player x position matrices: membership, rank tier (ceil(rank / slots)) and where the
+        # position sits in the player's positions list.  The rank is the row label, which
+        # calculate_z_scores sets to the z_total ordering.
+        member = np.zeros((n, k), dtype=bool)
+        tier = np.zeros((n, k))
+        group_rows = []
+        for j, (pos, df) in enumerate(zip(pos_list, frames)):
+            player_rows = ids.get_indexer(df[key])
+            first = ~df[key].duplicated().to_numpy()
+            member[player_rows[first], j] = True
+            tier[player_rows[first], j] = np.ceil(df.index.to_numpy()[first] / slots[pos])
+            group_rows.append(player_rows)
+
+        unlisted = np.iinfo(np.int64).max
+        list_order = np.full((n, k), unlisted, dtype=np.int64)
+        exploded = players["positions"].explode()
+        cols = pd.Index(pos_list).get_indexer(exploded.to_numpy())
+        listed = cols >= 0
+        np.minimum.at(list_order, (exploded.index.to_numpy()[listed], cols[listed]),
+                      exploded.groupby(level=0).cumcount().to_numpy()[listed])
+
+        multi = multi_eligible(encode_positions(players["positions"]))
+
+        # positions in dict order, every player at once: a multi-position player still in the
+        # group is compared with the first listed alt position group they are still in, and
+        # dropped from whichever group they rank lower in
+        for j in range(k):
+            alt_order = np.where(member, list_order, unlisted)
+            alt_order[:, j] = unlisted
+            alt = alt_order.argmin(axis=1)
+            moves = member[:, j] & multi & (alt_order[rows, alt] != unlisted)
+            keep_here = tier[:, j] < tier[rows, alt]
+            member[rows[moves & keep_here], alt[moves & keep_here]] = False
+            member[moves & ~keep_here, j] = False
+
+        pos_groups = {pos: {**pos_groups[pos], "players": df[member[group_rows[j], j]]}
+                      for j, (pos, df) in enumerate(zip(pos_list, frames))}
 
         return pos_groups
 
@@ -189,22 +256,20 @@ class Transformer:
         pos_groups = self.calc_rlp_arms(sps=self.sps, rps=self.rps)
 
         for pos, group in pos_groups.items():
-            pos_groups[pos]["players"] = self.calculate_z_scores(df=group["players"],
-                                                                 rlp_dict=group["rlp"],
-                                                                 pos=pos,
-                                                                 categories=self.ruleset["SCORING"][
-                                                                     "PITCHING"])
+            pos_groups[pos]["players"] = self.calculate_z_scores(
+                df=group["players"], rlp_dict=group["rlp"], pos=pos,
+                categories=self.pitching_categories,
+                top_k=self.get_players_at_pos(pos) + RLP_WINDOW)
 
         # re-calculate based on initial sorted
         pos_groups = self.calc_rlp_arms(sps=pos_groups["SP"]["players"],
                                         rps=pos_groups["RP"]["players"])
 
         for pos, group in pos_groups.items():
-            pos_groups[pos]["players"] = self.calculate_z_scores(df=group["players"],
-                                                                 rlp_dict=group["rlp"],
-                                                                 pos=pos,
-                                                                 categories=self.ruleset["SCORING"][
-                                                                     "PITCHING"])
+            pos_groups[pos]["players"] = self.calculate_z_scores(
+                df=group["players"], rlp_dict=group["rlp"], pos=pos,
+                categories=self.pitching_categories,
+                top_k=self.get_players_at_pos(pos) + RLP_WINDOW)
 
         return pos_groups
 
@@ -220,11 +285,11 @@ class Transformer:
 
         sp_rlp_group = self.rlp_group(arms["SP"]["players"], "SP")
         # add RLP inner key
-        arms["SP"]["rlp"] = reduce_rlp_group(sp_rlp_group)
+        arms["SP"]["rlp"] = reduce_rlp_group(sp_rlp_group, self.pitching_categories)
         # del arms["SP"]["rlp"]["proj_SVHD"]
 
         rp_rlp_group = self.rlp_group(arms["RP"]["players"], "RP")
-        arms["RP"]["rlp"] = reduce_rlp_group(rp_rlp_group)
+        arms["RP"]["rlp"] = reduce_rlp_group(rp_rlp_group, self.pitching_categories)
         # del arms["RP"]["rlp"]["proj_QS"]
 
         return arms
@@ -237,10 +302,17 @@ class Transformer:
         :return: Dataframe of RLP group, just outside position reqs
         """
         num_players = self.get_players_at_pos(pos)
-        rlp_range = slice(num_players, num_players + 5)
+        rlp_range = slice(num_players, num_players + RLP_WINDOW)
         return df[rlp_range]
 
     def get_players_at_pos(self, pos: str) -> int:
+        return self.no_managers * self.get_pos_slots(pos)
+
+    def get_pos_slots(self, pos: str) -> int:
+        """
+        :param pos: roster position, SP or RP
+        :return: roster slots per team at the position; the wildcard pitchers are bucketed
+        """
         match pos:
             case "SP":
                 pos_slots, _ = bucket_wildcard_arms(self.ruleset)
@@ -249,16 +321,65 @@ class Transformer:
             case _:
                 pos_slots = self.ruleset["ROSTER_REQS"]["BATTERS"][pos]
 
-        return self.no_managers * pos_slots
+        return pos_slots
+
+    def sweep_pool_sizes(self, df: pd.DataFrame, pos: str, no_managers=None, slots=None,
+                         reorder: bool = True) -> dict:
+        """
+        Replacement level, pool std and z-scores of a position group for many league sizes and
+        slot counts at once, without rerunning the pipeline per scenario.  Every scenario's
+        pool and RLP window are read off cumulative sums (and sums of squares) over the ranked
+        category block, see sweep_z_scores.
+        :param df: position group; its row order is the first ranking, as for #rlp_group
+        :param pos: position of the group, selects the categories and the default slots
+        :param no_managers: list-like of league sizes, defaults to this league's
+        :param slots: list-like of roster slots per team at pos, defaults to this league's
+        :param reorder: like #z_arms, rerank every scenario on its first pass z_total and
+            compute the RLP, std and z-scores again.  False only runs the first pass.
+        :return: dict with
+            scenarios: Dataframe of no_managers, slots and pool_size per scenario, one row per
+                no_managers x slots combination
+            rlp: Dataframe of the RLP means, scenario x proj_ category
+            std: Dataframe of the pool sample std, scenario x proj_ category
+            z: np.ndarray of z-scores, scenario x player x proj_ category, players in df order
+            z_total: Dataframe of z_total, df.index x scenario
+        """
+        no_managers = np.atleast_1d(self.no_managers if no_managers is None else no_managers)
+        slots = np.atleast_1d(self.get_pos_slots(pos) if slots is None else slots)
+        managers_grid, slots_grid = (grid.ravel() for grid in
+                                     np.meshgrid(no_managers, slots, indexing="ij"))
+        pool_sizes = managers_grid * slots_grid
+        categories = (self.pitching_categories if pos in ["SP", "RP"] else
+                      self.batting_categories)
+        proj_cats = [f"proj_{cat}" for cat in categories if f"proj_{cat}" in df.columns]
+        block = df[proj_cats].to_numpy(dtype=np.float64)
+        lower_is_better = np.isin(proj_cats, LOWER_IS_BETTER)
+
+        order = np.broadcast_to(np.arange(len(df)), (len(pool_sizes), len(df)))
+        z, rlp, std = sweep_z_scores(block, order, pool_sizes, lower_is_better)
+        if reorder:
+            # rank on z_total, descending, as select_top does
+            z_total = np.nansum(z, axis=2)
+            order = np.argsort(-z_total, axis=1, kind="stable")
+            z, rlp, std = sweep_z_scores(block, order, pool_sizes, lower_is_better)
+
+        return {"scenarios": pd.DataFrame({"no_managers": managers_grid, "slots": slots_grid,
+                                           "pool_size": pool_sizes}),
+                "rlp": pd.DataFrame(rlp, columns=proj_cats),
+                "std": pd.DataFrame(std, columns=proj_cats),
+                "z": z,
+                "z_total": pd.DataFrame(np.nansum(z, axis=2).T, index=df.index)}
 
     def calculate_z_scores(self,
                            df: pd.DataFrame,
                            rlp_dict: dict,
                            pos: str,
-                           categories: list) -> pd.DataFrame:
+                           categories: list,
+                           top_k: int = None) -> pd.DataFrame:
         """Calculates z-scores for projected league-relevant stat columns and adds them to the
         DataFrame.
-            Also sorts on total z-score
+            Also sorts on total z-score.  All scored categories are computed together as one
+            players x categories block and written back in one assignment.
 
         Note:
             We apply a sqrt normalization on the z-scores to reduce high-end outliers
@@ -268,68 +389,241 @@ class Transformer:
                                values are corresponding means.
             pos (str): Position of the players
             categories (list): List of category names
+            top_k (int): only order the top_k rows by z_total (the pool and RLP window); the
+                rest follow in their current order.  None sorts every row.
 
         Returns:
             pd.DataFrame: DataFrame with new z-score columns.
         """
         num_players = self.get_players_at_pos(pos)
-        z_df = df.copy().reset_index(drop=True)  # reset index so #loc slicking works in a few lines
-        for cat in categories:
-            proj_cat = "proj_" + cat
-            if proj_cat in rlp_dict:
-                rlp_mean = rlp_dict[proj_cat]
-                # loc slicing is inclusive, need to subtract 1
-                std = z_df.loc[:num_players - 1, proj_cat].std(ddof=1)  # Sample standard deviation
-                if proj_cat in ["proj_ERA", "proj_WHIP"]:
-                    # since lower values are more desirable, need to swap num
-                    # sign indicator reapplied after the abs function
-                    # #sqrt cannot be applied to neg numbers
-                    sign_indicator = np.where((rlp_mean - z_df[proj_cat]) >= 0, 1, -1)
-                    cat_z_scores = np.sqrt(
-                        np.abs((rlp_mean - z_df[proj_cat]) / std)) * sign_indicator
-                else:
-
-                    sign_indicator = np.where((z_df[proj_cat] - rlp_mean) >= 0, 1, -1)
-                    cat_z_scores = np.sqrt(
-                        np.abs((z_df[proj_cat] - rlp_mean) / std)) * sign_indicator
-
-                z_df.loc[:, "z_" + proj_cat] = self.normalize_cat_z_scores(cat_z_scores, pos=pos)
-
-        drop_cols = ["z_total", "z_swing_miss_percent", "oz_swing_percent"]
-        # Calculate Total of 'z' columns
-        z_df.loc[:, "z_total"] = z_df.filter(like="z_").drop(drop_cols, axis=1,
-                                                             errors="ignore").sum(axis=1)
-        z_df.sort_values("z_total", ascending=False, inplace=True)
+        # reset index so the top num_players rows are the pool; reset_index already returns a
+        # new frame, copying the data only when copy-on-write is off
+        z_df = df.reset_index(drop=True)
+        proj_cats = [f"proj_{cat}" for cat in categories if f"proj_{cat}" in rlp_dict]
+
+        # all scored categories as one players x categories block
+        block = z_df[proj_cats].to_numpy(dtype=np.float64)
+        rlp = np.array([rlp_dict[proj_cat] for proj_cat in proj_cats], dtype=np.float64)
+        diff = block - rlp
+        # since lower values are more desirable, the sign is swapped for these
+        lower_is_better = np.isin(proj_cats, LOWER_IS_BETTER)
+        diff[:, lower_is_better] *= -1
+        # sample standard deviation of the pool
+        std = nan_std(block[:num_players])
+        # #sqrt cannot be applied to neg numbers; sign indicator reapplied after the abs function
+        z_block = np.sqrt(np.abs(diff / std)) * np.where(diff >= 0, 1, -1)
+        # normalize by the lowest z-score in the pool, so the pool's lowest z-score is 0
+        z_block -= np.fmin.reduce(z_block[:num_players], axis=0, initial=np.nan)
+
+        z_df[[f"z_{proj_cat}" for proj_cat in proj_cats]] = z_block
+        z_df["z_total"] = np.nansum(z_block, axis=1)
+        if top_k is None:
+            z_df.sort_values("z_total", ascending=False, inplace=True)
+        else:
+            z_df = select_top(z_df, "z_total", top_k)
         z_df.reset_index(drop=True, inplace=True)
 
         return z_df
 
-    def normalize_cat_z_scores(self, pds: pd.Series, pos: str) -> pd.Series:
+
+def reduce_rlp_group(df: pd.DataFrame, categories: list) -> dict:
+    """
+    Reduce by averaging the scored projection columns
+    :param df: Dataframe of position's RLP group
+    :param categories: scored category names, e.g. ["HR", "OBP"]
+    :return: dict of proj_ columns of the scored categories reduced by averaging
+    """
+    proj_cats = df.columns.intersection([f"proj_{cat}" for cat in categories])
+    # averaged in float64, projections may be downcast (see cleaner.lean_dtypes)
+    return df[proj_cats].astype(np.float64).mean().to_dict()
+
+
+class PlayerPool:
+    def __init__(self, df: pd.DataFrame = None):
         """
-        Normalize the z-scores for the given DataFrame by way of adding the largest negative
-        number from the relevant
-        :param pos: Position of the player DataFrame
-        :param pds:  with z-scores
-        :return: pandas Series with normalized z-scores
+        Insertion ordered set of players keyed on player_key, each pointing at the row it was
+        added from.  Adding keeps the first row seen for a player and removing only touches the
+        removed players, so the pool is never rebuilt; to_frame() materializes it.
+        :param df: players to start the pool with
         """
-        num_players = self.get_players_at_pos(pos)
-        # series slicing is range exclusive, diff from #loc[slicing]
-        lowest_value = pds[:num_players].min()
-        normalized = pds - lowest_value
+        self.frames = []
+        # player_key -> (frame number, row position)
+        self.rows = {}
+        if df is not None:
+            self.add(df)
 
-        return normalized
+    def add(self, df: pd.DataFrame) -> None:
+        """
+        Add players not already in the pool
+        :param df: players, with a player_key (or ESPNID) column
+        """
+        frame_no = len(self.frames)
+        self.frames.append(df)
+        for row, player_key in enumerate(df[player_key_column(df)].to_numpy()):
+            self.rows.setdefault(player_key, (frame_no, row))
 
+    def remove(self, player_keys) -> None:
+        """
+        :param player_keys: list-like of player keys to drop from the pool
+        """
+        for player_key in player_keys:
+            self.rows.pop(player_key, None)
 
-def reduce_rlp_group(df: pd.DataFrame) -> dict:
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: the pool's rows in the order the players were added; columns are the union of
+            every added frame's columns
+        """
+        if not self.frames:
+            return pd.DataFrame()
+
+        offsets = np.cumsum([0] + [len(df) for df in self.frames])
+        positions = np.fromiter((offsets[frame_no] + row for frame_no, row in self.rows.values()),
+                                dtype=np.int64, count=len(self.rows))
+        return pd.concat(self.frames).iloc[positions]
+
+
+def check_batting_slots(ruleset: dict) -> None:
     """
-    Reduce by averaging numerical columns
-    :param df: Dataframe of position's RLP group
-    :return: dict of numerical columns reduced by averaging
+    Batters are grouped on their position bitmasks, so every batting roster slot must be a
+    position in cleaner.POSITION_BITS
+    :param ruleset: League specific ruleset
+    :return: None
+    """
+    unknown = [slot for slot in ruleset["ROSTER_REQS"]["BATTERS"] if slot not in POSITION_BITS]
+    if unknown:
+        raise ValueError(f"Unsupported batting roster slots {unknown}, expected slots from "
+                         f"{list(POSITION_BITS)}.")
+
+
+def with_player_key(master: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param master: cleaned players
+    :return: master with an int32 player_key, factorized from ESPNID if the Loader did not set
+        one
+    """
+    if "player_key" in master.columns:
+        return master
+
+    return master.assign(player_key=pd.factorize(master["ESPNID"])[0].astype(np.int32))
+
+
+def player_key_column(df: pd.DataFrame) -> str:
+    """
+    :param df: players
+    :return: column to join players on: player_key, or ESPNID for frames built without one
+    """
+    return "player_key" if "player_key" in df.columns else "ESPNID"
+
+
+def work_table(master: pd.DataFrame, categories: list) -> pd.DataFrame:
+    """
+    The narrow table position groups are cut from: WORK_COLUMNS and the scored proj_ columns of
+    the master, plus master_row, each row's position in the master
+    :param master: cleaned bats, sps or rps
+    :param categories: scored category names
+    :return: Dataframe aligned to master
+    """
+    columns = master.columns.intersection(WORK_COLUMNS + [f"proj_{cat}" for cat in categories],
+                                          sort=False)
+
+    return master[columns].assign(master_row=np.arange(len(master), dtype=np.int64))
+
+
+def select_top(df: pd.DataFrame, by: str, k: int, ascending: bool = False) -> pd.DataFrame:
+    """
+    Partial sort: the top k rows on `by` are selected with a partition and ordered, the other
+    rows follow in their current order.  The top k and their order are those of a stable
+    sort_values; NaNs rank last.
+    :param df: Dataframe to order
+    :param by: column to rank on
+    :param k: number of rows to order, e.g. the draftable pool plus the RLP window
+    :param ascending: rank low values first
+    :return: reordered df
+    """
+    values = df[by].to_numpy(dtype=np.float64)
+    key = np.where(np.isnan(values), np.inf, values if ascending else -values)
+    k = min(k, len(key))
+    if k == 0:
+        return df
+
+    kth = np.partition(key, k - 1)[k - 1]
+    above = np.flatnonzero(key < kth)
+    # ties at the kth value go to the earliest rows, so the top k are those of a stable sort
+    top = np.concatenate([above, np.flatnonzero(key == kth)[:k - len(above)]])
+    top = top[np.argsort(key[top], kind="stable")]
+    rest = np.ones(len(key), dtype=bool)
+    rest[top] = False
+
+    return df.iloc[np.concatenate([top, np.flatnonzero(rest)])]
+
+
+def nan_std(block: np.ndarray) -> np.ndarray:
+    """
+    Column-wise sample standard deviation (ddof=1) skipping NaNs, like pd.DataFrame.std
+    :param block: 2-D array
+    :return: std per column; NaN where a column has fewer than 2 values
+    """
+    present = ~np.isnan(block)
+    count = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(present, block, 0).sum(axis=0) / count
+        squares = np.where(present, block - mean, 0) ** 2
+        return np.sqrt(squares.sum(axis=0) / (count - 1))
+
+
+def sweep_z_scores(block: np.ndarray, order: np.ndarray, pool_sizes: np.ndarray,
+                   lower_is_better: np.ndarray) -> tuple:
+    """
+    #calculate_z_scores for many pool sizes at once.  Each scenario's ranked block gets prefix
+    sums of its values, squares and counts, so the pool (the top pool_size players) and the
+    RLP window (the RLP_WINDOW players after it) of every scenario are differences of two
+    prefix sums.  Values are centered on the column means first so the sum of squares doesn't
+    cancel.
+    :param block: players x categories projections
+    :param order: scenario x player, each scenario's ranking as row positions into block
+    :param pool_sizes: draftable pool size per scenario
+    :param lower_is_better: per category, whether its sign is swapped
+    :return: z (scenario x player x category, players in block order), rlp means and pool std
+        (both scenario x category)
     """
-    # Select numeric columns
-    numeric_cols = df.select_dtypes(include='number').columns.drop(["ESPNID", "MLBID"],
-                                                                   errors="ignore")
-    return df[numeric_cols].mean().to_dict()
+    n_scenarios, n_players = order.shape
+    scenarios = np.arange(n_scenarios)
+    ranked = block[order]
+    present = ~np.isnan(ranked)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shift = np.nan_to_num(np.nansum(block, axis=0) / (~np.isnan(block)).sum(axis=0))
+    centered = np.where(present, ranked - shift, 0)
+
+    def prefix_sums(values: np.ndarray) -> np.ndarray:
+        # row i holds the sum over the top i ranked players
+        return np.concatenate([np.zeros((n_scenarios, 1, block.shape[1])),
+                               np.cumsum(values, axis=1)], axis=1)
+
+    counts, sums, squares = (prefix_sums(values) for values in
+                             (present, centered, centered ** 2))
+    pool_end = np.minimum(pool_sizes, n_players)
+    rlp_end = np.minimum(pool_sizes + RLP_WINDOW, n_players)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rlp = ((sums[scenarios, rlp_end] - sums[scenarios, pool_end]) /
+               (counts[scenarios, rlp_end] - counts[scenarios, pool_end])) + shift
+        pool_count = counts[scenarios, pool_end]
+        pool_sum = sums[scenarios, pool_end]
+        variance = (squares[scenarios, pool_end] - pool_sum ** 2 / pool_count) / (pool_count - 1)
+        std = np.sqrt(np.maximum(variance, 0))
+
+        diff = block - rlp[:, None, :]
+        diff[:, :, lower_is_better] *= -1
+        z = np.sqrt(np.abs(diff / std[:, None, :])) * np.where(diff >= 0, 1, -1)
+
+    # normalize by the lowest z-score in each scenario's pool
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.broadcast_to(np.arange(n_players), order.shape), axis=1)
+    in_pool = (rank < pool_end[:, None])[:, :, None]
+    z -= np.fmin.reduce(np.where(in_pool, z, np.nan), axis=1, initial=np.nan)[:, None, :]
+
+    return z, rlp, std
 
 
 def bucket_wildcard_arms(ruleset: dict) -> tuple:
@@ -1,8 +1,17 @@
+import hashlib
+import html
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pandas as pd
 import pytest
 
 from mtbl_iokit.read import read
 
+from app.src.keymap import KEYMAP_FILE
+
 
 def savant_fixture(pos, fix_dir="./tests/fixtures") -> ():
     """
@@ -62,4 +71,75 @@ def mock_fangraphs_reg_szn(_, pos) -> pd.DataFrame:
     elif pos == "arms":
         return fangraphs_fixture("arms", fix_dir="./tests/fixtures_reg_szn")
     else:
-        raise ValueError(f"Unexpected position: {pos}")
\ No newline at end of file
+        raise ValueError(f"Unexpected position: {pos}")
+
+
+def keymap_fixture_dir(tmp_dir, fix_dir="./tests/fixtures") -> str:
+    """
+    Copies the fixture keymap to tmp_dir, so the parquet cache KeyMap writes next to it stays
+    out of the checked-in fixtures
+    :return: keymap directory
+    """
+    shutil.copy(os.path.join(fix_dir, KEYMAP_FILE), tmp_dir)
+    return str(tmp_dir)
+
+
+def keymap_sheet_html(records: list) -> str:
+    """
+    Renders keymap records the way the published Google Sheet does: a row of column letters,
+    then the header row, with each row numbered in the first column
+    :param records: keymap records, i.e. the data key of mtbl_keymap.json
+    :return: html page holding the sheet table
+    """
+    columns = list(records[0].keys())
+    letters = "".join(f"<th>{chr(ord('A') + i)}</th>" for i in range(len(columns)))
+    rows = [f"<tr><th>1</th>{''.join(f'<td>{col}</td>' for col in columns)}</tr>"]
+    for row_no, record in enumerate(records, start=2):
+        cells = "".join(f"<td>{html.escape(str(record[col])) if record[col] is not None else ''}"
+                        f"</td>" for col in columns)
+        rows.append(f"<tr><th>{row_no}</th>{cells}</tr>")
+
+    return (f"<html><body><table><thead><tr><th></th>{letters}</tr></thead>"
+            f"<tbody>{''.join(rows)}</tbody></table></body></html>")
+
+
+class KeymapSheetServer:
+    """
+    Local HTTP stand-in for the published keymap sheet.  Honors If-None-Match and counts the
+    full responses it sends
+    """
+    def __init__(self, records: list):
+        self.full_responses = 0
+        self.set_records(records)
+        sheet = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.headers.get("If-None-Match") == sheet.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = sheet.html.encode("utf-8")
+                sheet.full_responses += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("ETag", sheet.etag)
+                self.send_header("Last-Modified", "Sat, 01 Jun 2024 00:00:00 GMT")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/pubhtml"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def set_records(self, records: list) -> None:
+        self.html = keymap_sheet_html(records)
+        self.etag = '"' + hashlib.sha256(self.html.encode("utf-8")).hexdigest()[:16] + '"'
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,10 +1,11 @@
+import numpy as np
 import pandas as pd
 import pytest
 
 from app.src.cleaner import Cleaner
 from app.src.transformer import Transformer
 from app.src.appraiser import Appraiser
-from app.src.mtbl_globals import ETLType, LG_RULESET, NO_MANAGERS
+from app.src.mtbl_globals import ETLType, LG_RULESET, NO_MANAGERS, BUDGET_SPLIT
 
 
 class TestAppraiser:
@@ -22,40 +23,8 @@ class TestAppraiser:
         trxfmr = Transformer(LG_RULESET, NO_MANAGERS, cleaned_bats, cleaned_sps, cleaned_rps)
         self.bats = trxfmr.z_bats()
         self.arms = trxfmr.z_arms()
-        self.budget_pref = {
-            "bats": {
-                "ovr": 0.65,
-                "cats": {
-                    "HR": 0.20,
-                    "R": 0.15,
-                    "RBI": 0.10,
-                    "SBN": 0.15,
-                    "OBP": 0.20,
-                    "SLG": 0.20
-                }
-            },
-            "sps": {
-                "ovr": 0.20,
-                "cats": {
-                    "IP": 0.15,
-                    "QS": 0.20,
-                    "ERA": 0.20,
-                    "WHIP": 0.20,
-                    "K/9": 0.25
-                }
-            },
-            "rps": {
-                "ovr": 0.15,
-                "cats": {
-                    "IP": 0.15,
-                    "SVHD": 0.20,
-                    "ERA": 0.20,
-                    "WHIP": 0.20,
-                    "K/9": 0.25
-                }
-            }
-        }
-        self.app = Appraiser(LG_RULESET, NO_MANAGERS, self.budget_pref, bats=self.bats,
+        self.budget_split = BUDGET_SPLIT
+        self.app = Appraiser(LG_RULESET, NO_MANAGERS, self.budget_split, bats=self.bats,
                              arms=self.arms)
         yield
 
@@ -102,7 +71,7 @@ class TestAppraiser:
                                                    :num_players - 1, f"z_proj_{cat.split('_')[0]}"])
 
         assert tot_bat_shekels.__round__(0) == round(
-            self.app.lg_budget * self.budget_pref["bats"]["ovr"], 0)
+            self.app.lg_budget * self.budget_split["bats"]["ovr"], 0)
 
     @pytest.mark.parametrize("setup_data", [
         ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
@@ -129,7 +98,7 @@ class TestAppraiser:
                                               :num_players - 1, f"z_proj_{cat.split('_')[0]}"])
 
         assert tot_sp_shekels.__round__(0) == round(
-            self.app.lg_budget * self.budget_pref["sps"]["ovr"], 0)
+            self.app.lg_budget * self.budget_split["sps"]["ovr"], 0)
 
         tot_rp_shekels = 0
         num_players = self.app.pos_groups["RP"]["pool_size"]
@@ -139,7 +108,7 @@ class TestAppraiser:
                                               :num_players - 1, f"z_proj_{cat.split('_')[0]}"])
 
         assert tot_rp_shekels.__round__(0) == round(
-            self.app.lg_budget * self.budget_pref["rps"]["ovr"], 0)
+            self.app.lg_budget * self.budget_split["rps"]["ovr"], 0)
 
     @pytest.mark.parametrize("setup_data", [
         ("fixtures", ETLType.PRE_SZN)], indirect=True)
@@ -159,3 +128,69 @@ class TestAppraiser:
 
         for pos, pos_group in self.app.pos_groups.items():
             assert isinstance(pos_group["players"].loc[0, "shekels"], float)
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_price_profiles(self, setup_data):
+        punt_saves = {**BUDGET_SPLIT, "sps": {**BUDGET_SPLIT["sps"], "ovr": 0.30},
+                      "rps": {**BUDGET_SPLIT["rps"], "ovr": 0.05}}
+        power = {**BUDGET_SPLIT, "bats": {"ovr": 0.65, "cats": {
+            "HR": 0.30, "R": 0.15, "RBI": 0.20, "SBN": 0.05, "OBP": 0.10, "SLG": 0.20}}}
+        profiles = {"balanced": BUDGET_SPLIT, "punt_saves": punt_saves, "power": power}
+
+        prices = self.app.price_profiles(profiles)
+
+        assert prices.columns.tolist() == ["ESPNID", "pos", "balanced", "punt_saves", "power"]
+        assert "shekels" not in self.app.pos_groups["SS"]["players"].columns
+        for name, budget_split in profiles.items():
+            # the same as pricing each profile on its own
+            app = Appraiser(LG_RULESET, NO_MANAGERS, budget_split, bats=self.bats,
+                            arms=self.arms)
+            app.calculate_league_batting_category_totals()
+            app.calculate_batting_category_weights_shekels()
+            app.calculate_pitching_category_weights_shekels()
+            app.add_skekels()
+            expected = pd.concat([pos_group["players"]["shekels"] for pos_group in
+                                  app.pos_groups.values()], ignore_index=True)
+            np.testing.assert_allclose(prices[name], expected, rtol=1e-9, atol=1e-9)
+
+        assert prices["ESPNID"].tolist() == pd.concat(
+            [pos_group["players"]["ESPNID"] for pos_group in self.app.pos_groups.values()]).tolist()
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_price_profiles_invalid(self, setup_data):
+        lopsided = {**BUDGET_SPLIT, "bats": {**BUDGET_SPLIT["bats"], "ovr": 0.9}}
+
+        with pytest.raises(ValueError):
+            self.app.price_profiles({"balanced": BUDGET_SPLIT, "lopsided": lopsided})
+
+    @pytest.mark.parametrize("fixture_path, etl_type", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)])
+    def test_add_shekels_copy_on_write(self, fixture_path, etl_type):
+        def appraise() -> dict:
+            str_dtypes = {col: str for col in ["ESPNID", "FANGRAPHSID", "MLBID"]}
+            combined_bats = pd.read_json(f"./tests/{fixture_path}/combined_bats.json",
+                                         dtype=str_dtypes)
+            combined_arms = pd.read_json(f"./tests/{fixture_path}/combined_arms.json",
+                                         dtype=str_dtypes)
+            cleaner = Cleaner(etl_type=etl_type, bats=combined_bats, arms=combined_arms)
+            cleaned_bats = cleaner.clean_hitters()
+            cleaned_sps, cleaned_rps = cleaner.clean_pitchers()
+            trxfmr = Transformer(LG_RULESET, NO_MANAGERS, cleaned_bats, cleaned_sps, cleaned_rps)
+            app = Appraiser(LG_RULESET, NO_MANAGERS, BUDGET_SPLIT, bats=trxfmr.z_bats(),
+                            arms=trxfmr.z_arms())
+            app.calculate_league_batting_category_totals()
+            app.calculate_batting_category_weights_shekels()
+            app.calculate_pitching_category_weights_shekels()
+            app.add_skekels()
+            return app.pos_groups
+
+        expected = appraise()
+        with pd.option_context("mode.copy_on_write", True):
+            pos_groups = appraise()
+
+        for pos, pos_group in pos_groups.items():
+            pd.testing.assert_frame_equal(pos_group["players"], expected[pos]["players"])
@@ -2,7 +2,8 @@ import pytest
 import pandas as pd
 
 from app.src.mtbl_globals import ETLType
-from app.src.cleaner import Cleaner
+from app.src.cleaner import (Cleaner, encode_positions, eligible, listed_first,
+                             multi_eligible, lean_dtypes)
 
 
 class TestCleaner:
@@ -45,3 +46,51 @@ class TestCleaner:
         assert "ESPNID", "FANGRAPHSID" in self.cleaned_sps.columns.tolist()
         assert self.cleaned_sps.iloc[0]["proj_FIP"] <= self.cleaned_sps.iloc[1]["proj_FIP"]
         assert "SVHD" in self.cleaned_rps.columns.tolist()
+
+    def test_encode_positions(self):
+        positions = pd.Series([["1B", "DH"], ["DH"], ["DH", "OF"], [], None, ["OF", "SS"]],
+                              index=[5, 3, 9, 1, 0, 2])
+        pos_mask = encode_positions(positions)
+
+        assert eligible(pos_mask, "DH").tolist() == [True, True, True, False, False, False]
+        assert eligible(pos_mask, "SS").tolist() == [False, False, False, False, False, True]
+        assert listed_first(pos_mask, "DH").tolist() == [False, True, True, False, False, False]
+        assert multi_eligible(pos_mask).tolist() == [True, False, True, False, False, True]
+
+    def test_clean_hitters_pos_mask(self, setup_reg_szn):
+        pos_mask = self.cleaned_bats["pos_mask"]
+
+        for pos in ["C", "1B", "2B", "3B", "SS", "OF", "DH"]:
+            expected = self.cleaned_bats["positions"].apply(lambda positions: pos in positions)
+            assert eligible(pos_mask, pos).tolist() == expected.tolist()
+
+    def test_lean_dtypes(self):
+        df = pd.DataFrame({"team": ["NYY", "BOS", "NYY"],
+                           "proj_HR": pd.array([40, None, 12], dtype="Int64"),
+                           "proj_PA": pd.array([700, 650, 40000], dtype="Int64"),
+                           "proj_OBP": pd.array([0.35, 0.3, None], dtype="Float64"),
+                           "player_key": pd.array([0, 1, 2], dtype="int64"),
+                           "name": ["a", "b", "c"]})
+
+        assert lean_dtypes(df) == {"team": "category", "proj_HR": "Int16", "proj_PA": "Int32",
+                                   "proj_OBP": "Float32"}
+        assert lean_dtypes(df.astype(lean_dtypes(df))) == {}
+
+    def test_clean_low_memory(self):
+        combined_bats = pd.read_json("./tests/fixtures_reg_szn/combined_bats.json")
+        combined_arms = pd.read_json("./tests/fixtures_reg_szn/combined_arms.json")
+        cleaned_bats = Cleaner(ETLType.REG_SZN, combined_bats.copy(),
+                               combined_arms.copy()).clean_hitters()
+        cleaner = Cleaner(ETLType.REG_SZN, combined_bats, combined_arms, low_memory=True)
+        lean_bats = cleaner.clean_hitters()
+        cleaner.clean_pitchers()
+
+        assert isinstance(lean_bats["team"].dtype, pd.CategoricalDtype)
+        assert isinstance(lean_bats["owner"].dtype, pd.CategoricalDtype)
+        assert lean_bats["proj_HR"].dtype == "int16"
+        assert lean_bats["proj_OBP"].dtype == "float32"
+        pd.testing.assert_frame_equal(lean_bats, cleaned_bats, check_dtype=False,
+                                      check_categorical=False, rtol=1e-6)
+        assert list(cleaner.frame_bytes) == ["clean bats", "clean sps", "clean rps"]
+        for before, after in cleaner.frame_bytes.values():
+            assert after < before
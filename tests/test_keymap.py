@@ -1,20 +1,49 @@
 import csv
+import hashlib
 import json
 import os
 import tempfile
 import time
+import warnings
 
+import numpy as np
 import pandas as pd
 import pytest
 import pytest_benchmark
 
-from app.src.keymap import KeyMap
+from app.src import keymap as keymap_module
+from app.src.keymap import (KeyMap, KEYMAP_CACHE_FILE, KEYMAP_FILE, convert_num_id_cols,
+                            file_sha256, normalize_id_col)
+from tests.fixtures.mock_helper import KeymapSheetServer, keymap_fixture_dir
+
+
+def row_wise_convert_num_id_cols(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reference for the original row-wise #convert_num_id_cols
+    """
+    def float_to_str(x):
+        if pd.notna(x).any():
+            for idx in range(len(x)):
+                if isinstance(x.iloc[idx], float) and not pd.isnull(x.iloc[idx]):
+                    x.iloc[idx] = str(int(x.iloc[idx]))
+        return x
+
+    with warnings.catch_warnings():
+        # row-wise str assignment into float rows is deprecated in pandas
+        warnings.simplefilter("ignore", FutureWarning)
+        df[["MLBID", "ESPNID"]] = df[["MLBID", "ESPNID"]].apply(float_to_str, axis=1)
+
+    return df
 
 
 class TestKeymap:
     @pytest.fixture
-    def km(self):
-        return KeyMap("tests/fixtures").keymap
+    def keymap_dir(self, tmp_path):
+        return keymap_fixture_dir(tmp_path)
+
+    @pytest.fixture
+    def km(self, keymap_dir):
+        return KeyMap(keymap_dir).keymap
 
     def test_keymap(self, km):
         assert isinstance(km, pd.DataFrame)
@@ -44,9 +73,186 @@ class TestKeymap:
         result = benchmark(indexing_pandas)
         assert result is not None
 
+    def test_translate_single(self, keymap_dir):
+        km = KeyMap(keymap_dir)
+        assert km.translate("42404", src="ESPNID", dst="MLBID") == "682998"
+        # numeric ids are normalized before lookup
+        assert km.translate(682998, src="MLBID", dst="ESPNID") == "42404"
+        assert km.translate("not-an-id", src="ESPNID", dst="MLBID") is None
+
+    def test_translate_bulk(self, keymap_dir):
+        km = KeyMap(keymap_dir)
+        mlb_ids = km.keymap["MLBID"].dropna().drop_duplicates()
+        fg_ids = km.translate(mlb_ids, src="MLBID", dst="FANGRAPHSID")
+
+        expected = km.keymap.drop_duplicates("MLBID").set_index("MLBID")["FANGRAPHSID"]
+        assert isinstance(fg_ids, pd.Series)
+        assert fg_ids.index.equals(mlb_ids.index)
+        assert fg_ids.tolist() == expected.loc[mlb_ids].tolist()
+
+        with pytest.raises(KeyError):
+            km.translate(["42404"], src="ESPNID", dst="TEAM")
+
+    def test_indexing_crosswalk(self, keymap_dir, benchmark):
+        km = KeyMap(keymap_dir)
+        mlb_ids = km.keymap["MLBID"].dropna().tolist()
+
+        result = benchmark(km.translate, mlb_ids, "MLBID", "ESPNID")
+        assert len(result) == len(mlb_ids)
+
+    @pytest.fixture
+    def raw_keymap(self):
+        with open("tests/fixtures/mtbl_keymap.json") as f:
+            data = pd.DataFrame(json.load(f)["data"])
+        # read_html hands back the id columns as floats with NaN for missing keys
+        data["MLBID"] = pd.to_numeric(data["MLBID"], errors="coerce")
+        data["ESPNID"] = pd.to_numeric(data["ESPNID"], errors="coerce")
+        return data
+
+    def test_convert_num_id_cols(self, raw_keymap):
+        expected = row_wise_convert_num_id_cols(raw_keymap.copy())
+        result = convert_num_id_cols(raw_keymap.copy())
+
+        pd.testing.assert_frame_equal(result, expected)
+        assert result.loc[result["ESPNID"] == "42404", "PLAYERNAME"].iloc[0] == "Corbin Carroll"
+        assert result["ESPNID"].isna().sum() == raw_keymap["ESPNID"].isna().sum()
+
+    def test_convert_num_id_cols_mixed(self):
+        df = pd.DataFrame({"MLBID": ["681035", 678692.0, None, np.nan],
+                           "ESPNID": [4414215.0, "5006093", np.nan, "4905923"]})
+        expected = row_wise_convert_num_id_cols(df.copy())
+        result = convert_num_id_cols(df.copy())
+
+        pd.testing.assert_frame_equal(result, expected)
+
+    @pytest.mark.parametrize("ids, expected", [
+        ([682998, None], ["682998", None]),
+        ([681035.0, np.nan, 42404], ["681035", np.nan, "42404"])])
+    def test_normalize_id_col_object_numbers(self, ids, expected):
+        # object columns holding no strings at all
+        result = normalize_id_col(pd.Series(ids, dtype=object))
+
+        pd.testing.assert_series_equal(result, pd.Series(expected, dtype=object))
+
+    def test_translate_object_numbers(self, keymap_dir):
+        km = KeyMap(keymap_dir)
+        result = km.translate(pd.Series([682998], dtype=object), src="MLBID", dst="ESPNID")
+
+        assert result.tolist() == ["42404"]
+
+    def test_convert_num_id_cols_as_int(self, raw_keymap):
+        result = convert_num_id_cols(raw_keymap.copy(), as_int=True)
+
+        assert result["ESPNID"].dtype == pd.Int64Dtype()
+        assert result["ESPNID"].isna().sum() == raw_keymap["ESPNID"].isna().sum()
+
+    def test_indexing_convert_ids_row_wise(self, raw_keymap, benchmark):
+        result = benchmark(lambda: row_wise_convert_num_id_cols(raw_keymap.copy()))
+        assert result is not None
+
+    def test_indexing_convert_ids_vectorized(self, raw_keymap, benchmark):
+        result = benchmark(lambda: convert_num_id_cols(raw_keymap.copy()))
+        assert result is not None
+
+    def test_keymap_cache_warm(self, keymap_dir, monkeypatch):
+        cold = KeyMap(keymap_dir).keymap
+        assert os.path.exists(os.path.join(keymap_dir, KEYMAP_CACHE_FILE))
+
+        def no_json(*args, **kwargs):
+            raise AssertionError("warm cache should not parse json")
+
+        monkeypatch.setattr(keymap_module, "read_keymap_json", no_json)
+        warm = KeyMap(keymap_dir).keymap
+
+        pd.testing.assert_frame_equal(cold, warm)
+        assert warm.loc["42404"]["PLAYERNAME"] == "Corbin Carroll"
+
+    def test_keymap_cache_touched(self, keymap_dir, monkeypatch):
+        KeyMap(keymap_dir)
+        # new mtime, same content; hash check keeps the cache valid
+        source = os.path.join(keymap_dir, KEYMAP_FILE)
+        os.utime(source, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+        def no_json(*args, **kwargs):
+            raise AssertionError("touched file with same content should hit the cache")
+
+        monkeypatch.setattr(keymap_module, "read_keymap_json", no_json)
+        KeyMap(keymap_dir)
+
+    def test_file_sha256(self, tmp_path):
+        # larger than a hashing block
+        data = os.urandom(3 * (1 << 20) + 17)
+        (tmp_path / "extract.csv").write_bytes(data)
+
+        assert file_sha256(str(tmp_path / "extract.csv")) == hashlib.sha256(data).hexdigest()
+
+    def test_keymap_cache_stale(self, keymap_dir):
+        KeyMap(keymap_dir)
+        source = os.path.join(keymap_dir, KEYMAP_FILE)
+        with open(source) as f:
+            data = json.load(f)
+        data["data"] = [p for p in data["data"] if p["ESPNID"] != "42404"]
+        with open(source, "w") as f:
+            json.dump(data, f)
+
+        km = KeyMap(keymap_dir).keymap
+        assert "42404" not in km.index
+
+    def test_load_keymap_cached(self, keymap_dir, benchmark):
+        KeyMap(keymap_dir)
+        result = benchmark(lambda: KeyMap(keymap_dir).keymap)
+        assert result is not None
+
+    @pytest.fixture
+    def sheet(self):
+        with open(os.path.join("tests/fixtures", KEYMAP_FILE)) as f:
+            records = json.load(f)["data"]
+        server = KeymapSheetServer(records)
+        yield server, records
+        server.shutdown()
+
+    def test_incremental_refresh(self, sheet, tmp_path):
+        server, records = sheet
+        save_dir = str(tmp_path)
+
+        summary = KeyMap.refresh_keymap(save_dir, incremental=True, url=server.url)
+        assert summary["status"] == "created"
+        assert KeyMap(save_dir).translate("42404", "ESPNID", "MLBID") == "682998"
+
+        # same ETag -> 304, nothing parsed
+        summary = KeyMap.refresh_keymap(save_dir, incremental=True, url=server.url)
+        assert summary == {"status": "not_modified", "added": 0, "removed": 0}
+        assert server.full_responses == 1
+
+        # one player's team changes and one player is removed
+        changed = [dict(r) for r in records if r["ESPNID"] != "42404"]
+        changed[0]["TEAM"] = "XYZ"
+        server.set_records(changed)
+        summary = KeyMap.refresh_keymap(save_dir, incremental=True, url=server.url)
+        assert summary == {"status": "updated", "added": 1, "removed": 2}
+
+        km = KeyMap(save_dir)
+        assert km.translate("42404", "ESPNID", "MLBID") is None
+        assert km.keymap.loc[km.keymap["PLAYERNAME"] == changed[0]["PLAYERNAME"], "TEAM"].tolist() \
+               == ["XYZ"]
+        assert len(km.keymap) == len(changed)
+
+    def test_incremental_refresh_unchanged(self, sheet, tmp_path):
+        server, records = sheet
+        save_dir = str(tmp_path)
+        KeyMap.refresh_keymap(save_dir, incremental=True, url=server.url)
+        mtime = os.stat(os.path.join(save_dir, KEYMAP_FILE)).st_mtime_ns
+
+        # new ETag but identical rows, e.g. the sheet was re-published
+        server.etag = '"republished"'
+        summary = KeyMap.refresh_keymap(save_dir, incremental=True, url=server.url)
+
+        assert summary["status"] == "unchanged"
+        assert os.stat(os.path.join(save_dir, KEYMAP_FILE)).st_mtime_ns == mtime
+
     # @pytest.mark.skip(reason="network call")
-    def test_refresh_keymap(self):
-        test_dir = "./tests/fixtures_reg_szn"
+    def test_refresh_keymap(self, tmp_path):
+        test_dir = keymap_fixture_dir(tmp_path, "./tests/fixtures_reg_szn")
         KeyMap.refresh_keymap(test_dir)
 
         expected_file = "mtbl_keymap.json"  # Example filename
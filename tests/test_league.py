@@ -0,0 +1,116 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from app.src.cleaner import Cleaner
+from app.src.transformer import Transformer
+from app.src.appraiser import Appraiser
+from app.src.league import League, read_leagues, transform_leagues, appraise_leagues
+from app.src.mtbl_globals import (ETLType, LG_RULESET, NO_MANAGERS, BUDGET_SPLIT,
+                                  DIR_TRANSFORM)
+
+
+class TestLeague:
+    @pytest.fixture
+    def setup_reg_szn(self):
+        str_dtypes = {col: str for col in ["ESPNID", "FANGRAPHSID", "MLBID"]}
+        combined_bats = pd.read_json("./tests/fixtures_reg_szn/combined_bats.json",
+                                     dtype=str_dtypes)
+        combined_arms = pd.read_json("./tests/fixtures_reg_szn/combined_arms.json",
+                                     dtype=str_dtypes)
+        cleaner = Cleaner(etl_type=ETLType.REG_SZN, bats=combined_bats, arms=combined_arms)
+        self.clean_bats = cleaner.clean_hitters()
+        self.clean_sps, self.clean_rps = cleaner.clean_pitchers()
+        self.punt_saves = {**BUDGET_SPLIT, "sps": {**BUDGET_SPLIT["sps"], "ovr": 0.30},
+                           "rps": {**BUDGET_SPLIT["rps"], "ovr": 0.05}}
+
+    def value(self, leagues: list, parallel: bool = False) -> tuple:
+        transforms = transform_leagues(leagues, self.clean_bats, self.clean_sps, self.clean_rps,
+                                       parallel=parallel)
+        return transforms, appraise_leagues(leagues, transforms, parallel=parallel)
+
+    def test_single_league(self, setup_reg_szn):
+        _, league_players = self.value([League("mtbl", out_dir="out")])
+
+        transformer = Transformer(LG_RULESET, NO_MANAGERS, self.clean_bats, self.clean_sps,
+                                  self.clean_rps)
+        app = Appraiser(LG_RULESET, NO_MANAGERS, BUDGET_SPLIT, bats=transformer.z_bats(),
+                        arms=transformer.z_arms())
+        app.calculate_league_batting_category_totals()
+        app.calculate_batting_category_weights_shekels()
+        app.calculate_pitching_category_weights_shekels()
+        app.add_skekels()
+
+        assert list(league_players["mtbl"]) == list(app.pos_groups)
+        for pos, pos_group in app.pos_groups.items():
+            expected = transformer.to_frame(pos, pos_group["players"]).sort_values(
+                "z_total", ascending=False)
+            pd.testing.assert_frame_equal(league_players["mtbl"][pos], expected)
+
+    def test_leagues_share_transform(self, setup_reg_szn):
+        leagues = [League("balanced"), League("punt_saves", budget_split=self.punt_saves),
+                   League("small", no_managers=8)]
+        transforms, league_players = self.value(leagues)
+        _, balanced = self.value([League("balanced")])
+
+        # the ruleset and league size of balanced and punt_saves are the same
+        assert len(transforms) == 2
+        for pos in ["SS", "SP", "RP"]:
+            shared = league_players["balanced"][pos]["z_total"]
+            assert shared.equals(league_players["punt_saves"][pos]["z_total"])
+            # pricing one league does not leak into the other
+            pd.testing.assert_frame_equal(league_players["balanced"][pos],
+                                          balanced["balanced"][pos])
+        assert (league_players["punt_saves"]["SP"]["shekels"].sum() >
+                league_players["balanced"]["SP"]["shekels"].sum())
+        assert len(league_players["small"]["SS"]) < len(league_players["balanced"]["SS"])
+
+    def test_parallel_leagues(self, setup_reg_szn):
+        leagues = [League("balanced"), League("punt_saves", budget_split=self.punt_saves),
+                   League("small", no_managers=8), League("large", no_managers=14)]
+        _, serial = self.value(leagues)
+        _, parallel = self.value(leagues, parallel=True)
+
+        for league in leagues:
+            for pos, players in serial[league.name].items():
+                pd.testing.assert_frame_equal(parallel[league.name][pos], players)
+
+    def test_budget_profiles(self, setup_reg_szn):
+        leagues = [League("balanced"), League("small", no_managers=8)]
+        transforms = transform_leagues(leagues, self.clean_bats, self.clean_sps, self.clean_rps)
+        league_players = appraise_leagues(leagues, transforms, budget_profiles={
+            "balanced": BUDGET_SPLIT, "punt_saves": self.punt_saves})
+
+        for league in leagues:
+            prices = league_players[league.name]["profiles"]
+            assert prices.columns.tolist() == ["ESPNID", "pos", "balanced", "punt_saves"]
+            # the league's own split prices the same as its balanced profile
+            ss = prices[prices["pos"] == "SS"].set_index("ESPNID")["balanced"]
+            players = league_players[league.name]["SS"].set_index("ESPNID")["shekels"]
+            pd.testing.assert_series_equal(ss[players.index], players, check_names=False)
+
+    def test_league_names_unique(self, setup_reg_szn):
+        with pytest.raises(ValueError):
+            self.value([League("mtbl"), League("mtbl", no_managers=8)])
+
+    def test_unknown_batting_slot(self):
+        ruleset = {**LG_RULESET, "ROSTER_REQS": {
+            **LG_RULESET["ROSTER_REQS"],
+            "BATTERS": {**LG_RULESET["ROSTER_REQS"]["BATTERS"], "UTIL": 1}}}
+
+        with pytest.raises(ValueError, match="UTIL"):
+            League("util", ruleset=ruleset)
+
+    def test_read_leagues(self, tmp_path):
+        path = tmp_path / "leagues.json"
+        path.write_text(json.dumps([{"name": "home", "no_managers": 12},
+                                    {"name": "work", "out_dir": str(tmp_path / "work")}]))
+        home, work = read_leagues(str(path))
+
+        assert home.no_managers == 12 and home.ruleset == LG_RULESET
+        assert home.budget_split == BUDGET_SPLIT
+        assert home.out_dir == os.path.join(DIR_TRANSFORM, "home")
+        assert work.out_dir == str(tmp_path / "work") and work.no_managers == NO_MANAGERS
+        assert home.transform_key() != work.transform_key()
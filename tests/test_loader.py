@@ -1,23 +1,32 @@
+import csv
+import os
+import shutil
+
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 from app.src.mtbl_globals import ETLType
+from app.src.cleaner import Cleaner
 from app.src.keymap import KeyMap
-from app.src.loader import Loader
+from app.src.loader import (Loader, check_keymap_validity, read_typed_csv, read_universe,
+                            stream_typed_csv)
+from tests.fixtures.mock_helper import keymap_fixture_dir
 
 
 class TestLoader:
     @pytest.fixture
-    def setup_pre_szn(self):
+    def setup_pre_szn(self, tmp_path):
         # optionally refresh keymap during mods; comment out line if desired to use static file
         # KeyMap.refresh_keymap("./tests/fixtures")
         # setting to alt primary key since testing with preseason data
-        keymap = KeyMap("./tests/fixtures", primary_key="FANGRAPHSID").keymap
+        keymap = KeyMap(keymap_fixture_dir(tmp_path), primary_key="FANGRAPHSID").keymap
         yield keymap
 
     @pytest.fixture
-    def setup_reg_szn(self):
-        keymap = KeyMap("./tests/fixtures_reg_szn", primary_key="FANGRAPHSID").keymap
+    def setup_reg_szn(self, tmp_path):
+        keymap = KeyMap(keymap_fixture_dir(tmp_path, "./tests/fixtures_reg_szn"),
+                        primary_key="FANGRAPHSID").keymap
         yield keymap
 
     def test_instantiation(self, setup_pre_szn):
@@ -51,3 +60,246 @@ class TestLoader:
                                      orient="records", indent=2)
         loader.combined_arms.to_json("./tests/fixtures_reg_szn/combined_arms.json",
                                      orient="records", indent=2)
+
+    def test_load_extracted_data_parallel(self, setup_reg_szn):
+        serial = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn")
+        serial.load_extracted_data()
+        parallel = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn")
+        parallel.load_extracted_data(parallel=True)
+
+        pd.testing.assert_frame_equal(serial.combined_bats, parallel.combined_bats)
+        pd.testing.assert_frame_equal(serial.combined_arms, parallel.combined_arms)
+
+    def test_load_extracted_data_low_memory(self, setup_reg_szn):
+        loader = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn")
+        loader.load_extracted_data()
+        lean = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn", low_memory=True)
+        lean.load_extracted_data()
+
+        assert isinstance(lean.combined_bats["team"].dtype, pd.CategoricalDtype)
+        assert lean.combined_bats["proj_HR"].dtype == "Int16"
+        assert lean.combined_arms["proj_ERA"].dtype == "Float32"
+        assert lean.combined_bats["player_key"].dtype == "int32"
+        pd.testing.assert_frame_equal(lean.combined_bats, loader.combined_bats, check_dtype=False,
+                                      check_categorical=False, rtol=1e-6)
+        assert list(lean.frame_bytes) == ["combined bats", "combined arms"]
+        for before, after in lean.frame_bytes.values():
+            assert after < before
+
+    def test_import_fangraphs_typed(self, setup_reg_szn):
+        loader = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn")
+        bats = loader.import_fangraphs("bats")
+
+        assert bats["proj_HR"].dtype == pd.Int64Dtype()
+        assert bats["proj_wRC+"].dtype == pd.Float64Dtype()
+        assert bats["PlayerId"].dtype == object
+        # empty cells are '' in string columns, NA in numeric columns
+        assert (bats["MLBAMID"] == "").any()
+        assert bats["G"].isna().any()
+
+    def test_read_typed_csv_fallback(self, tmp_path):
+        (tmp_path / "bats_test.csv").write_text("PlayerId,proj_G,proj_AVG\n1,152.0,0.311\n2,,x\n")
+        schema = {"PlayerId": str, "proj_G": pd.Int64Dtype(), "proj_AVG": pd.Float64Dtype()}
+
+        df = read_typed_csv(str(tmp_path), "bats_test", schema, str)
+
+        assert df["proj_G"].tolist()[0] == 152
+        assert df["proj_G"].dtype == pd.Int64Dtype()
+        assert df["proj_AVG"].isna().tolist() == [False, True]
+        assert df["PlayerId"].tolist() == ["1", "2"]
+
+    def test_import_savant_empty_rows(self, setup_pre_szn, tmp_path):
+        with open("./tests/fixtures/bats_savant.csv") as f:
+            lines = f.read().splitlines()
+        no_cols = len(next(csv.reader(lines[:1])))
+        # two rows of only delimiters and quoted blanks, as a bad export would have
+        lines[3:3] = ["," * (no_cols - 1), '""' + "," * (no_cols - 1)]
+        (tmp_path / "bats_savant.csv").write_text("\n".join(lines) + "\n")
+
+        loader = Loader(setup_pre_szn, ETLType.PRE_SZN, str(tmp_path))
+        bats = loader.import_savant("bats")
+
+        assert loader.empty_rows_dropped == {"bats_savant": 2}
+        assert len(bats) == len(lines) - 3
+        assert not bats["player_id"].eq("").any()
+
+    def test_combine_dataframes_join_plan(self, setup_reg_szn):
+        loader = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn")
+        loader.load_extracted_data()
+
+        for combined in [loader.combined_bats, loader.combined_arms]:
+            assert not combined.columns.str.endswith(("_x", "_y")).any()
+            assert not combined["ESPNID"].duplicated().any()
+            assert list(combined.columns[-4:]) == ["MLBID", "FANGRAPHSID", "ESPNID", "player_key"]
+            assert combined["player_key"].dtype == "int32"
+            assert not combined["player_key"].duplicated().any()
+        # savant keys come through as MLBID, fangraphs keys as FANGRAPHSID
+        assert loader.combined_bats["MLBID"].notna().any()
+        assert loader.combined_bats["FANGRAPHSID"].notna().all()
+
+    @pytest.mark.parametrize("etl_type, extract_dir", [
+        (ETLType.PRE_SZN, "./tests/fixtures"),
+        (ETLType.REG_SZN, "./tests/fixtures_reg_szn")])
+    def test_load_projected_columns(self, etl_type, extract_dir, tmp_path):
+        keymap = KeyMap(keymap_fixture_dir(tmp_path, extract_dir), primary_key="FANGRAPHSID").keymap
+        full = Loader(keymap, etl_type, extract_dir)
+        full.load_extracted_data()
+        projected = Loader(keymap, etl_type, extract_dir, project_columns=True)
+        projected.load_extracted_data()
+
+        assert len(projected.combined_bats.columns) < len(full.combined_bats.columns)
+        assert len(projected.combined_arms.columns) < len(full.combined_arms.columns)
+
+        full_cleaner = Cleaner(etl_type, full.combined_bats, full.combined_arms)
+        projected_cleaner = Cleaner(etl_type, projected.combined_bats, projected.combined_arms)
+        pd.testing.assert_frame_equal(full_cleaner.clean_hitters(),
+                                      projected_cleaner.clean_hitters())
+        for full_arms, projected_arms in zip(full_cleaner.clean_pitchers(),
+                                             projected_cleaner.clean_pitchers()):
+            pd.testing.assert_frame_equal(full_arms, projected_arms)
+
+    def test_load_extracted_data_cached(self, setup_reg_szn, tmp_path):
+        extract_dir = tmp_path / "extract"
+        shutil.copytree("./tests/fixtures_reg_szn", extract_dir)
+        cache_dir = str(tmp_path / "cache")
+
+        cold = Loader(setup_reg_szn, ETLType.REG_SZN, str(extract_dir), cache_dir=cache_dir)
+        cold.load_extracted_data()
+        assert set(cold.cache_status.values()) == {"miss"}
+        assert len(cold.cache_status) == 5
+
+        warm = Loader(setup_reg_szn, ETLType.REG_SZN, str(extract_dir), cache_dir=cache_dir)
+        warm.load_extracted_data()
+        assert set(warm.cache_status.values()) == {"hit"}
+        pd.testing.assert_frame_equal(cold.combined_bats, warm.combined_bats)
+        pd.testing.assert_frame_equal(cold.combined_arms, warm.combined_arms)
+
+        # only the changed file is parsed again
+        with open(extract_dir / "bats_savant.csv", "a") as f:
+            f.write("\n")
+        rerun = Loader(setup_reg_szn, ETLType.REG_SZN, str(extract_dir), cache_dir=cache_dir)
+        rerun.load_extracted_data()
+        assert [file for file, status in rerun.cache_status.items()
+                if status == "miss"] == ["bats_savant"]
+        assert len(os.listdir(cache_dir)) == 5
+        pd.testing.assert_frame_equal(cold.combined_bats, rerun.combined_bats)
+
+    def test_load_extracted_data_cached_projected(self, setup_reg_szn, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        loaders = {}
+        for project_columns in [False, True, False, True]:
+            loader = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn",
+                            project_columns=project_columns, cache_dir=cache_dir)
+            loader.load_extracted_data()
+            loaders.setdefault(project_columns, []).append(loader)
+
+        # full and projected reads are cached side by side instead of evicting each other
+        for cold, warm in loaders.values():
+            assert set(warm.cache_status.values()) == {"hit"}
+            pd.testing.assert_frame_equal(cold.combined_bats, warm.combined_bats)
+            pd.testing.assert_frame_equal(cold.combined_arms, warm.combined_arms)
+        # the universe is read whole either way, so only its entry is shared
+        projected_cold = loaders[True][0].cache_status
+        assert [file for file, status in projected_cold.items()
+                if status == "hit"] == ["espn_player_universe"]
+        assert len(os.listdir(cache_dir)) == 9
+
+    @pytest.mark.parametrize("pos", ["bats", "arms"])
+    def test_import_savant_chunked(self, setup_pre_szn, tmp_path, pos):
+        with open(f"./tests/fixtures/{pos}_savant.csv") as f:
+            lines = f.read().splitlines()
+        no_cols = len(next(csv.reader(lines[:1])))
+        lines[5:5] = ["," * (no_cols - 1)]
+        lines[300:300] = ["," * (no_cols - 1)]
+        (tmp_path / f"{pos}_savant.csv").write_text("\n".join(lines) + "\n")
+
+        whole = Loader(setup_pre_szn, ETLType.PRE_SZN, str(tmp_path))
+        chunked = Loader(setup_pre_szn, ETLType.PRE_SZN, str(tmp_path), chunk_size=4096)
+
+        pd.testing.assert_frame_equal(whole.import_savant(pos), chunked.import_savant(pos))
+        assert chunked.empty_rows_dropped == whole.empty_rows_dropped == {f"{pos}_savant": 2}
+
+    def test_stream_typed_csv_fallback(self, tmp_path, capsys):
+        lines = ["PlayerId,proj_G,proj_AVG"] + [f"{i},{i},0.{i}" for i in range(1, 200)]
+        lines.append("200,152.0,0.311")
+        (tmp_path / "bats_test.csv").write_text("\n".join(lines) + "\n")
+        schema = {"PlayerId": str, "proj_G": pd.Int64Dtype(), "proj_AVG": pd.Float64Dtype()}
+
+        df = stream_typed_csv(str(tmp_path), "bats_test", schema, str, chunk_size=256)
+
+        # the fallback is reported, not silent
+        out = capsys.readouterr().out
+        assert "bats_test.csv" in out and "152.0" in out
+        pd.testing.assert_frame_equal(df, read_typed_csv(str(tmp_path), "bats_test", schema, str))
+
+    def test_stream_typed_csv_malformed(self, tmp_path):
+        lines = ["PlayerId,proj_G"] + [f"{i},{i}" for i in range(1, 200)] + ["200,1,extra"]
+        (tmp_path / "bats_test.csv").write_text("\n".join(lines) + "\n")
+        schema = {"PlayerId": str, "proj_G": pd.Int64Dtype()}
+
+        with pytest.raises(pa.ArrowInvalid):
+            stream_typed_csv(str(tmp_path), "bats_test", schema, str, chunk_size=256)
+
+    @pytest.mark.parametrize("fixture_dir", ["./tests/fixtures", "./tests/fixtures_reg_szn"])
+    def test_read_universe(self, fixture_dir):
+        universe = read_universe(f"{fixture_dir}/espn_player_universe.json")
+
+        # same frame as json_normalize-ing the nested player_stats
+        df = pd.read_json(f"{fixture_dir}/espn_player_universe.json", dtype={"espn_id": str})
+        player_stats = pd.json_normalize(df.pop("player_stats"))
+        if "PRTR" in player_stats.columns:
+            player_stats = player_stats.add_prefix("prtr_")
+        expected = pd.concat([df, player_stats], axis=1)
+
+        pd.testing.assert_frame_equal(universe, expected)
+        assert isinstance(universe.loc[0, "positions"], list)
+
+    def test_read_universe_missing_stats(self, tmp_path):
+        (tmp_path / "espn_player_universe.json").write_text(
+            '[{"name": "A", "positions": ["C"], "player_stats": {"PRTR": 1.5, "HR": 2},'
+            ' "espn_id": "1"}, {"name": "B", "positions": ["SP"], "player_stats": {},'
+            ' "espn_id": "2"}]')
+        universe = read_universe(str(tmp_path / "espn_player_universe.json"))
+
+        assert list(universe.columns) == ["name", "positions", "espn_id", "prtr_PRTR", "prtr_HR"]
+        assert universe["prtr_HR"].isna().tolist() == [False, True]
+
+    def test_check_keymap_validity(self, tmp_path, capsys):
+        fangraphs = pd.DataFrame({"Name": ["A", "B", "C"], "PlayerId": ["1", "2", "sa3"],
+                                  "FANGRAPHSID": ["1", None, None]})
+        check = check_keymap_validity(fangraphs, "FANGRAPHSID", "FANGRAPHS", "bats", str(tmp_path))
+
+        assert not check
+        assert check.count == 2
+        assert check.ids("PlayerId").tolist() == ["2", "sa3"]
+        # only the summary is printed, the report is rendered on demand
+        out = capsys.readouterr().out
+        assert "2 players" in out and "sa3" not in out
+        assert "sa3" in check.report()
+        sidecar = pd.read_parquet(tmp_path / "keymap_check.bats.fangraphs.parquet")
+        assert sidecar["PlayerId"].tolist() == ["2", "sa3"]
+
+        savant = pd.DataFrame({"last_name, first_name": ["D, E", "F, G"], "player_id": ["4", "5"],
+                               "FANGRAPHSID": [None, "sa5"], "ESPNID": ["44", None]})
+        check = check_keymap_validity(savant, "FANGRAPHSID", "SAVANT", report_dir=str(tmp_path))
+        assert check.count == 1 and check.ids("player_id").tolist() == ["5"]
+        # missing ids stay null in the sidecar
+        sidecar = pd.read_parquet(tmp_path / "keymap_check.savant.parquet")
+        assert sidecar["FANGRAPHSID"].tolist() == ["sa5"]
+        assert sidecar["ESPNID"].isna().all()
+        capsys.readouterr()
+
+        check = check_keymap_validity(savant.iloc[:1], "FANGRAPHSID", "SAVANT")
+        assert check and check.report() == ""
+        assert capsys.readouterr().out == ""
+
+    def test_load_extracted_data_keymap_checks(self, setup_reg_szn, tmp_path):
+        loader = Loader(setup_reg_szn, ETLType.REG_SZN, "./tests/fixtures_reg_szn",
+                        keymap_report_dir=str(tmp_path))
+        loader.load_extracted_data()
+
+        for pos_group in ["bats", "arms"]:
+            assert set(loader.keymap_checks[pos_group]) == {"FANGRAPHS", "SAVANT"}
+            for source, check in loader.keymap_checks[pos_group].items():
+                sidecar = tmp_path / f"keymap_check.{pos_group}.{source.lower()}.parquet"
+                assert sidecar.exists() == (check.count > 0)
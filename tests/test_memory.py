@@ -0,0 +1,42 @@
+import pandas as pd
+
+from app.src.memory import (StageMemory, compare_report, peak_rss_mb, frame_bytes,
+                            frame_bytes_report)
+
+
+class TestMemory:
+    def test_peak_rss_mb(self):
+        assert peak_rss_mb() > 0
+
+    def test_stage_memory(self):
+        memory = StageMemory()
+        with memory.stage("alloc"):
+            block = bytearray(64 * 1024 * 1024)
+            block[::4096] = b"\x01" * len(block[::4096])  # touch the pages so they are resident
+            del block
+        with memory.stage("noop"):
+            pass
+
+        assert list(memory.stages) == ["alloc", "noop"]
+        assert memory.stages["alloc"][1] >= 32
+        report = memory.report().splitlines()
+        assert len(report) == 3 and report[1].startswith("alloc")
+
+    def test_compare_report(self):
+        baseline, optimized = StageMemory(), StageMemory()
+        baseline.stages = {"load": (200.0, 50.0), "clean": (220.0, 20.0)}
+        optimized.stages = {"load": (180.0, 40.0), "clean": (190.0, 10.0)}
+
+        report = compare_report(baseline, optimized).splitlines()
+
+        assert len(report) == 3 and "default peak MB" in report[0] and "cow peak MB" in report[0]
+        assert report[1].split() == ["load", "200.0", "180.0", "-20.0", "50.0", "40.0", "-10.0"]
+        assert report[2].split()[3] == "-30.0"
+
+    def test_frame_bytes(self):
+        df = pd.DataFrame({"team": ["NYY", "BOS"] * 500, "proj_HR": range(1000)})
+        lean = df.astype({"team": "category", "proj_HR": "int16"})
+
+        assert frame_bytes(lean) < frame_bytes(df)
+        report = frame_bytes_report({"bats": (frame_bytes(df), frame_bytes(lean))}).splitlines()
+        assert len(report) == 2 and report[1].startswith("bats")
@@ -1,3 +1,6 @@
+import math
+
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -6,6 +9,57 @@ from app.src.mtbl_globals import ETLType, LG_RULESET, NO_MANAGERS
 from app.src.transformer import *
 
 
+def legacy_set_pri_pos(pos_groups: dict, slots: dict) -> dict:
+    """
+    Reference for the original itertuples/drop #set_pri_pos
+    """
+    pos_groups = {pos: {**group, "players": group["players"].copy()}
+                  for pos, group in pos_groups.items()}
+    for pos_i in pos_groups:
+        bats = pos_groups[pos_i]["players"]
+        for player in bats.itertuples():
+            if len(player.positions) > 1:
+                for alt_pos in player.positions:
+                    if pos_i != alt_pos and alt_pos != "SP":
+                        match = pos_groups[alt_pos]["players"][
+                            pos_groups[alt_pos]["players"]["ESPNID"] == player.ESPNID]
+                        if len(match) == 0:
+                            continue
+                        if math.ceil(player.Index / slots[pos_i]) < math.ceil(
+                                match.index[0] / slots[alt_pos]):
+                            pos_groups[alt_pos]["players"].drop(match.index[0], inplace=True)
+                        else:
+                            pos_groups[pos_i]["players"].drop(player.Index, inplace=True)
+                        break
+
+    return pos_groups
+
+
+def legacy_calculate_z_scores(df: pd.DataFrame, rlp_dict: dict, num_players: int,
+                              categories: list) -> pd.DataFrame:
+    """
+    Reference for the original per-category #calculate_z_scores
+    """
+    z_df = df.copy().reset_index(drop=True)
+    for cat in categories:
+        proj_cat = "proj_" + cat
+        if proj_cat in rlp_dict:
+            rlp_mean = rlp_dict[proj_cat]
+            std = z_df.loc[:num_players - 1, proj_cat].std(ddof=1)
+            diff = (rlp_mean - z_df[proj_cat] if proj_cat in ["proj_ERA", "proj_WHIP"] else
+                    z_df[proj_cat] - rlp_mean)
+            cat_z_scores = np.sqrt(np.abs(diff / std)) * np.where(diff >= 0, 1, -1)
+            z_df.loc[:, "z_" + proj_cat] = cat_z_scores - cat_z_scores[:num_players].min()
+
+    z_df.loc[:, "z_total"] = z_df.filter(like="z_").drop(
+        ["z_total", "z_swing_miss_percent", "oz_swing_percent"], axis=1, errors="ignore").sum(
+        axis=1)
+    z_df.sort_values("z_total", ascending=False, inplace=True)
+    z_df.reset_index(drop=True, inplace=True)
+
+    return z_df
+
+
 class TestTransformer:
     @pytest.fixture
     def setup_data(self, request):
@@ -78,6 +132,20 @@ class TestTransformer:
         assert isinstance(bats["SS"]["players"], pd.DataFrame)
         assert isinstance(bats["SS"]["rlp"], dict)
 
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_calc_initial_rlp_bats_eligibility(self, setup_data):
+        bats = self.transformer.calc_initial_rlp_bats()
+        cleaned_bats = self.transformer.bats
+
+        for pos in ["C", "1B", "2B", "3B", "SS", "OF"]:
+            expected = cleaned_bats[cleaned_bats["positions"].apply(lambda p: pos in p)]
+            assert bats[pos]["players"]["ESPNID"].tolist() == expected["ESPNID"].tolist()
+        only_dh = cleaned_bats[cleaned_bats["positions"].apply(lambda p: p[0] == "DH")]
+        assert only_dh["ESPNID"].isin(bats["DH"]["players"]["ESPNID"]).all()
+        assert "pos_mask" not in bats["SS"]["rlp"]
+
     @pytest.mark.parametrize("setup_data", [
         ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
     def test_calc_z_score_bats_reg_szn(self, setup_data):
@@ -96,25 +164,235 @@ class TestTransformer:
         assert ss_players.loc[0, "z_total"] >= ss_players.loc[1, "z_total"]
 
     @pytest.mark.parametrize("setup_data", [
+        ("fixtures", ETLType.PRE_SZN),
         ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
-    def test_cleanup_dh_pos_group_reg_szn(self, setup_data):
-        pos_groups = self.transformer.calc_initial_rlp_bats()
-        for pos, group in pos_groups.items():
-            pos_groups[pos]["players"] = self.transformer.calculate_z_scores(
-                df=group["players"],
-                rlp_dict=group["rlp"],
-                pos=pos,
-                categories=self.transformer.batting_categories)
+    def test_calc_z_scores_matches_legacy(self, setup_data):
+        cases = [(self.cleaned_bats, "SS", self.transformer.batting_categories),
+                 (self.cleaned_sps, "SP", self.transformer.pitching_categories),
+                 (self.cleaned_rps, "RP", self.transformer.pitching_categories)]
+        for df, pos, categories in cases:
+            rlp = reduce_rlp_group(self.transformer.rlp_group(df, pos), categories)
+            num_players = self.transformer.get_players_at_pos(pos)
+            expected = legacy_calculate_z_scores(df, rlp, num_players, categories)
+
+            result = self.transformer.calculate_z_scores(df=df, rlp_dict=rlp, pos=pos,
+                                                         categories=categories)
+
+            pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12)
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_calc_z_scores_top_k(self, setup_data):
+        rlp = reduce_rlp_group(self.transformer.rlp_group(self.cleaned_sps, "SP"),
+                               self.transformer.pitching_categories)
+        top_k = self.transformer.get_players_at_pos("SP") + RLP_WINDOW
+        kwargs = dict(df=self.cleaned_sps, rlp_dict=rlp, pos="SP",
+                      categories=self.transformer.pitching_categories)
+
+        full = self.transformer.calculate_z_scores(**kwargs)
+        partial = self.transformer.calculate_z_scores(**kwargs, top_k=top_k)
+
+        pd.testing.assert_frame_equal(partial[:top_k], full[:top_k])
+        assert sorted(partial["ESPNID"]) == sorted(full["ESPNID"])
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_position_groups_to_frame(self, setup_data):
+        bats = self.transformer.z_bats()
+        arms = self.transformer.z_arms()
+
+        # groups only carry the work columns, master_row and what was computed for them
+        assert "name" not in bats["SS"]["players"].columns
+        assert "master_row" in bats["DH"]["players"].columns
+
+        for pos, group in {**bats, **arms}.items():
+            master = self.transformer.masters[pos if pos in ["SP", "RP"] else "bats"]
+            df = self.transformer.to_frame(pos, group["players"])
+
+            export_columns = master.columns.drop(INTERNAL_COLUMNS, errors="ignore").tolist()
+            assert df.columns.tolist()[:len(export_columns)] == export_columns
+            assert "master_row" not in df.columns and "player_key" not in df.columns
+            assert "pos_mask" not in df.columns
+            assert "z_total" in df.columns
+            assert df["ESPNID"].tolist() == group["players"]["ESPNID"].tolist()
+            assert df["name"].tolist() == master.set_index("ESPNID").loc[
+                df["ESPNID"], "name"].tolist()
+
+    def test_low_memory_pri_pos(self, setup_str_dtypes):
+        combined_bats = pd.read_json(
+            "./tests/fixtures_reg_szn/combined_bats.json", dtype=setup_str_dtypes)
+        combined_arms = pd.read_json(
+            "./tests/fixtures_reg_szn/combined_arms.json", dtype=setup_str_dtypes)
+        cleaner = Cleaner(etl_type=ETLType.REG_SZN, bats=combined_bats, arms=combined_arms,
+                          low_memory=True)
+        clean_sps, clean_rps = cleaner.clean_pitchers()
+        transformer = Transformer(ruleset=LG_RULESET, no_managers=NO_MANAGERS,
+                                  bats=cleaner.clean_hitters(), sps=clean_sps, rps=clean_rps,
+                                  low_memory=True)
+        bats = transformer.z_bats()
+
+        for pos, group in bats.items():
+            assert isinstance(group["players"]["pri_pos"].dtype, pd.CategoricalDtype)
+            assert (group["players"]["pri_pos"] == pos).all()
+            # the z-scores are computed in float64 from the downcast projections
+            assert group["players"]["z_total"].dtype == np.float64
+
+    def test_player_pool(self):
+        first = pd.DataFrame({"ESPNID": ["1", "2", "3"], "proj_HR": [10, 20, 30]})
+        second = pd.DataFrame({"ESPNID": ["3", "4"], "proj_HR": [99, 40], "pri_pos": ["C", "C"]})
+        pool = PlayerPool(first)
+        pool.remove(["2", "5"])
+        pool.add(second)
+
+        df = pool.to_frame()
+
+        assert df["ESPNID"].tolist() == ["1", "3", "4"]
+        # the first row added for a player is kept
+        assert df["proj_HR"].tolist() == [10, 30, 40]
+        assert df.columns.tolist() == ["ESPNID", "proj_HR", "pri_pos"]
+        assert PlayerPool().to_frame().empty
+
+    @pytest.mark.parametrize("no_managers", [8, 10, 12, 14, 16])
+    @pytest.mark.parametrize("fixture_path, etl_type", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)])
+    def test_z_bats_matches_full_sort(self, setup_str_dtypes, monkeypatch, fixture_path,
+                                      etl_type, no_managers):
+        combined_bats = pd.read_json(
+            f"./tests/{fixture_path}/combined_bats.json", dtype=setup_str_dtypes)
+        combined_arms = pd.read_json(
+            f"./tests/{fixture_path}/combined_arms.json", dtype=setup_str_dtypes)
+        cleaner = Cleaner(etl_type=etl_type, bats=combined_bats, arms=combined_arms)
+        clean_bats = cleaner.clean_hitters()
+        clean_sps, clean_rps = cleaner.clean_pitchers()
+
+        calculate_z_scores = Transformer.calculate_z_scores
+
+        def z_bats() -> tuple:
+            # the DH players each z-score pass is handed, with the pass's pool size
+            dh_passes = []
+
+            def spy(transformer, df, rlp_dict, pos, categories, top_k=None):
+                if pos == "DH":
+                    dh_passes.append(df["player_key"].tolist()[
+                                     :transformer.get_players_at_pos(pos) + RLP_WINDOW])
+                return calculate_z_scores(transformer, df, rlp_dict, pos, categories, top_k)
+
+            monkeypatch.setattr(Transformer, "calculate_z_scores", spy)
+            bats = Transformer(LG_RULESET, no_managers, clean_bats, clean_sps,
+                               clean_rps).z_bats()
+            return bats, dh_passes
+
+        bats, dh_passes = z_bats()
+        # reference: every partial sort replaced by a full stable sort
+        monkeypatch.setattr("app.src.transformer.select_top",
+                            lambda df, by, k, ascending=False: df.sort_values(
+                                by, ascending=ascending, kind="stable"))
+        expected, expected_dh_passes = z_bats()
+
+        # both DH passes z-score the same pool and RLP window, in the same order
+        assert dh_passes == expected_dh_passes
+        for pos, group in expected.items():
+            expected_players = group["players"].set_index("player_key")
+            players = bats[pos]["players"].set_index("player_key")
+            assert sorted(players.index) == sorted(expected_players.index)
+            # the pool and RLP window are in the same order
+            top = no_managers * LG_RULESET["ROSTER_REQS"]["BATTERS"][pos] + RLP_WINDOW
+            assert players.index[:top].tolist() == expected_players.index[:top].tolist()
+            np.testing.assert_allclose(players.loc[expected_players.index, "z_total"],
+                                       expected_players["z_total"], atol=1e-6)
+
+    @pytest.mark.parametrize("no_managers", [8, 12, 16])
+    @pytest.mark.parametrize("fixture_path, etl_type", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)])
+    def test_z_bats_dh_excludes_top_players(self, setup_str_dtypes, fixture_path, etl_type,
+                                            no_managers):
+        combined_bats = pd.read_json(
+            f"./tests/{fixture_path}/combined_bats.json", dtype=setup_str_dtypes)
+        combined_arms = pd.read_json(
+            f"./tests/{fixture_path}/combined_arms.json", dtype=setup_str_dtypes)
+        cleaner = Cleaner(etl_type=etl_type, bats=combined_bats, arms=combined_arms)
+        clean_sps, clean_rps = cleaner.clean_pitchers()
+        transformer = Transformer(LG_RULESET, no_managers, cleaner.clean_hitters(), clean_sps,
+                                  clean_rps)
+
+        bats = transformer.z_bats()
+
+        dh_players = bats["DH"]["players"]["player_key"]
+        assert not dh_players.duplicated().any()
+        for pos, group in bats.items():
             if pos != "DH":
-                pos_groups["DH"]["players"] = self.transformer.cleanup_dh_pos_group(
-                    pos_groups=pos_groups,
-                    pos=pos)
+                # the players drafted at another position are not DH candidates
+                top_players = group["players"]["player_key"][
+                              :transformer.get_players_at_pos(pos)]
+                assert not dh_players.isin(top_players).any()
 
-                ros_reqs = self.transformer.ruleset["ROSTER_REQS"]["BATTERS"][pos]
-                num_players = ros_reqs * self.transformer.no_managers
+    def test_select_top(self):
+        df = pd.DataFrame({"stat": [3.0, np.nan, 9.0, 1.0, 7.0, 5.0]}, index=list("abcdef"))
 
-                assert True not in pos_groups["DH"]["players"]["ESPNID"].isin(
-                    pos_groups[pos]["players"][:num_players]["ESPNID"]).to_list()
+        assert select_top(df, "stat", 2).index.tolist() == ["c", "e", "a", "b", "d", "f"]
+        assert select_top(df, "stat", 2, ascending=True).index.tolist() == [
+            "d", "a", "b", "c", "e", "f"]
+        assert select_top(df, "stat", 10).index.tolist() == ["c", "e", "f", "a", "d", "b"]
+        assert select_top(df, "stat", 0).index.tolist() == list("abcdef")
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_reduce_rlp_group_scored_categories(self, setup_data):
+        rlp_group = self.transformer.rlp_group(self.cleaned_sps, "SP")
+
+        rlp = reduce_rlp_group(rlp_group, self.transformer.pitching_categories)
+
+        assert set(rlp) == {"proj_IP", "proj_QS", "proj_ERA", "proj_WHIP", "proj_K/9"}
+        assert rlp["proj_ERA"] == pytest.approx(rlp_group["proj_ERA"].mean())
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_sweep_pool_sizes_arms(self, setup_data):
+        sps = self.transformer.sps
+        sweep = self.transformer.sweep_pool_sizes(sps, "SP", no_managers=[8, 11, 14])
+
+        assert sweep["scenarios"]["pool_size"].tolist() == [8 * 4, 11 * 4, 14 * 4]
+        assert sweep["z"].shape == (3, len(sps), 5)
+        for i, no_managers in enumerate([8, 11, 14]):
+            # the same as z-scoring a league of that size
+            transformer = Transformer(LG_RULESET, no_managers, self.cleaned_bats,
+                                      self.cleaned_sps, self.cleaned_rps)
+            sp = transformer.z_arms()["SP"]
+            expected = sp["players"].set_index("player_key")["z_total"]
+            z_total = pd.Series(sweep["z_total"][i].to_numpy(), index=sps["player_key"])
+            np.testing.assert_allclose(z_total[expected.index], expected, atol=1e-6)
+            for proj_cat, mean in sp["rlp"].items():
+                assert sweep["rlp"].loc[i, proj_cat] == pytest.approx(mean)
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_sweep_pool_sizes_slots(self, setup_data):
+        outfield = self.transformer.bats[eligible(self.transformer.bats["pos_mask"], "OF")]
+        sweep = self.transformer.sweep_pool_sizes(outfield, "OF", slots=[3, 4, 5],
+                                                  reorder=False)
+
+        assert sweep["scenarios"]["slots"].tolist() == [3, 4, 5]
+        for i, slots in enumerate([3, 4, 5]):
+            ruleset = {**LG_RULESET, "ROSTER_REQS": {
+                **LG_RULESET["ROSTER_REQS"],
+                "BATTERS": {**LG_RULESET["ROSTER_REQS"]["BATTERS"], "OF": slots}}}
+            transformer = Transformer(ruleset, NO_MANAGERS, self.cleaned_bats, self.cleaned_sps,
+                                      self.cleaned_rps)
+            rlp = reduce_rlp_group(transformer.rlp_group(outfield, "OF"),
+                                   transformer.batting_categories)
+            z_df = transformer.calculate_z_scores(outfield, rlp, "OF",
+                                                  transformer.batting_categories)
+            pool = outfield[:NO_MANAGERS * slots]
+
+            for proj_cat in sweep["std"].columns:
+                assert sweep["rlp"].loc[i, proj_cat] == pytest.approx(rlp[proj_cat])
+                assert sweep["std"].loc[i, proj_cat] == pytest.approx(pool[proj_cat].std())
+            expected = z_df.set_index("player_key")["z_total"]
+            z_total = pd.Series(sweep["z_total"][i].to_numpy(), index=outfield["player_key"])
+            np.testing.assert_allclose(z_total[expected.index], expected, atol=1e-6)
 
     @pytest.mark.parametrize("setup_data", [
         ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
@@ -145,6 +423,52 @@ class TestTransformer:
 
         assert 5 not in pos_groups["1B"]["players"]["ESPNID"].to_list()
 
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures", ETLType.PRE_SZN),
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_set_pri_pos_matches_legacy(self, setup_data):
+        pos_groups = self.transformer.calc_initial_rlp_bats()
+        for pos, group in pos_groups.items():
+            group["players"] = self.transformer.calculate_z_scores(
+                df=group["players"], rlp_dict=group["rlp"], pos=pos,
+                categories=self.transformer.batting_categories)
+        expected = legacy_set_pri_pos(pos_groups, LG_RULESET["ROSTER_REQS"]["BATTERS"])
+
+        result = self.transformer.set_pri_pos(pos_groups)
+
+        for pos, group in expected.items():
+            pd.testing.assert_frame_equal(result[pos]["players"], group["players"])
+
+    @pytest.mark.parametrize("setup_data", [
+        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
+    def test_set_pri_pos_matches_legacy_random(self, setup_data):
+        rng = np.random.default_rng(7)
+        slots = LG_RULESET["ROSTER_REQS"]["BATTERS"]
+        pos_list = list(slots)
+        positions = {espn_id: list(rng.choice(pos_list, size=rng.integers(1, 4), replace=False))
+                     for espn_id in range(300)}
+        pos_groups = {}
+        for pos in pos_list:
+            ids = [espn_id for espn_id, eligible in positions.items() if pos in eligible]
+            ids = list(rng.permutation(ids))
+            pos_groups[pos] = {"players": pd.DataFrame({
+                "ESPNID": ids, "positions": [positions[espn_id] for espn_id in ids]})}
+        expected = legacy_set_pri_pos(pos_groups, slots)
+
+        result = self.transformer.set_pri_pos(pos_groups)
+
+        for pos, group in expected.items():
+            pd.testing.assert_frame_equal(result[pos]["players"], group["players"])
+
+    def test_unknown_batting_slot(self, setup_pre_szn):
+        ruleset = {**LG_RULESET, "ROSTER_REQS": {
+            **LG_RULESET["ROSTER_REQS"],
+            "BATTERS": {**LG_RULESET["ROSTER_REQS"]["BATTERS"], "CI": 1}}}
+
+        with pytest.raises(ValueError, match="CI"):
+            Transformer(ruleset, NO_MANAGERS, self.cleaned_bats, self.cleaned_sps,
+                        self.cleaned_rps)
+
     def test_calc_rlp_bats_pre_szn(self, setup_pre_szn):
         # standardize datasets
         bats = self.transformer.calc_initial_rlp_bats()
@@ -210,12 +534,3 @@ class TestTransformer:
         assert isinstance(arms["RP"]["players"], pd.DataFrame)
         assert isinstance(arms["SP"]["rlp"], dict)
         assert isinstance(arms["RP"]["rlp"], dict)
-
-    @pytest.mark.parametrize("setup_data", [
-        ("fixtures_reg_szn", ETLType.REG_SZN)], indirect=True)
-    def test_normalize_cat_z_scores(self, setup_data):
-        self.transformer.ruleset["ROSTER_REQS"]["BATTERS"]["test"] = 1
-        series = pd.Series([1, 2, 3, 4, -5, 6, 7, 8, 9, 10, 11, 12])
-        normalized = self.transformer.normalize_cat_z_scores(series, pos="test")
-        assert normalized.min() == 0
-        assert normalized.max() == 17